@@ -1,8 +1,14 @@
 import os
+import re
 import json
+import hashlib
+import sqlite3
+import uuid
 import threading
+import queue
 import time
 import datetime
+import httpx
 import pygame
 from tkinter import *
 from tkinter import ttk, messagebox
@@ -12,9 +18,23 @@ from dotenv import dotenv_values
 import edge_tts
 import asyncio
 import random
+import zlib
+import sys
+import shutil
+import subprocess
+import webbrowser
+import heapq
+import wave
+import io
+import unicodedata
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+import urllib.parse
+from collections import deque, OrderedDict
+import numpy as np
 import mtranslate as mt
 from selenium import webdriver
-from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
 from webdriver_manager.chrome import ChromeDriverManager
@@ -28,6 +48,214 @@ CohereAPIKey = env_vars.get("CohereAPIKey")
 InputLanguage = env_vars.get("InputLanguage", "en-US")
 AssistantVoice = env_vars.get("AssistantVoice", "en-US-JennyNeural")
 
+# LLM provider settings
+LLM_PROVIDER = env_vars.get("LLMProvider", "groq").lower()  # groq, openai or mock
+LLM_MODEL = env_vars.get("LLMModel", "llama-3.3-70b-versatile")
+LLM_BASE_URL = env_vars.get("LLMBaseURL", "http://localhost:11434/v1")
+LLM_API_KEY = env_vars.get("LLMAPIKey", "")
+HTTP_TIMEOUT = float(env_vars.get("HTTPTimeout", 30))
+HTTP_CONNECT_TIMEOUT = float(env_vars.get("HTTPConnectTimeout", 5))
+HTTP_MAX_CONNECTIONS = int(env_vars.get("HTTPMaxConnections", 20))
+MOCK_FIRST_TOKEN_LATENCY = float(env_vars.get("MockFirstTokenLatency", 0.3))
+MOCK_TOKENS_PER_SECOND = float(env_vars.get("MockTokensPerSecond", 50))
+
+# Hedged requests and failover
+HEDGE_REQUESTS = env_vars.get("HedgeRequests", "true").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(env_vars.get("HedgePercentile", 95))
+HEDGE_DEFAULT_DELAY = float(env_vars.get("HedgeDefaultDelay", 2.0))
+HEDGE_MIN_DELAY = float(env_vars.get("HedgeMinDelay", 0.5))
+HEDGE_MAX_DELAY = float(env_vars.get("HedgeMaxDelay", 10.0))
+HEDGE_MIN_SAMPLES = 10
+FALLBACK_PROVIDER = env_vars.get("FallbackProvider", "").lower()  # optional second backend: groq, openai or mock
+FALLBACK_MODEL = env_vars.get("FallbackModel", LLM_MODEL)
+BREAKER_FAILURE_THRESHOLD = int(env_vars.get("BreakerFailureThreshold", 3))
+BREAKER_COOLDOWN = float(env_vars.get("BreakerCooldown", 30))
+
+# Conversation engine
+ENGINE_LLM_CONCURRENCY = int(env_vars.get("EngineLLMConcurrency", 2))
+ENGINE_IO_CONCURRENCY = int(env_vars.get("EngineIOConcurrency", 4))
+UI_POLL_INTERVAL_MS = 20
+SUPERSEDE_IN_FLIGHT = env_vars.get("SupersedeInFlight", "true").lower() in ("1", "true", "yes")
+
+# Local intent classification in front of Cohere
+QUERY_CATEGORIES = [
+    "exit", "general", "realtime", "open", "close", "play",
+    "generate image", "system", "content", "google search",
+    "youtube search", "reminder"
+]
+INTENT_MODEL_PATH = "Data/IntentModel.npz"
+INTENT_LOG_PATH = "Data/IntentLog.jsonl"
+INTENT_FEATURE_DIM = 1 << 14
+INTENT_CONFIDENCE = float(env_vars.get("IntentConfidence", 0.85))
+INTENT_MIN_TRAINING = int(env_vars.get("IntentMinTraining", 50))
+INTENT_SHADOW_RATE = float(env_vars.get("IntentShadowRate", 0.05))
+INTENT_CACHE_SIZE = 1024
+INTENT_LEARNING_RATE = 0.5
+INTENT_SAVE_EVERY = 10
+
+# Speculative generation while the query is being categorized
+SPECULATIVE_GENERATION = env_vars.get("SpeculativeGeneration", "true").lower() in ("1", "true", "yes")
+SPECULATION_GRACE_MS = int(env_vars.get("SpeculationGraceMs", 30))
+# Categories answered by the chat model itself
+CHAT_CATEGORIES = ("general", "realtime")
+
+# Task execution for categorized commands
+ENGINE_TASK_CONCURRENCY = int(env_vars.get("TaskConcurrency", 4))
+TASK_TIMEOUT = float(env_vars.get("TaskTimeout", 20))
+CONTENT_TASK_TIMEOUT = float(env_vars.get("ContentTaskTimeout", 90))
+CONTENT_DIR = "Data/Content"
+# Apps are only launched from their menu entries, never as arbitrary executables
+APP_LAUNCHER_DIRS = {
+    "linux": [
+        "~/.local/share/applications",
+        "/usr/local/share/applications",
+        "/usr/share/applications",
+        "/var/lib/flatpak/exports/share/applications",
+        "/var/lib/snapd/desktop/applications"
+    ],
+    "win32": [
+        os.path.join(os.environ.get("APPDATA", ""), "Microsoft", "Windows", "Start Menu", "Programs"),
+        os.path.join(os.environ.get("ProgramData", ""), "Microsoft", "Windows", "Start Menu", "Programs")
+    ]
+}
+REMINDER_JOURNAL_PATH = "Data/Reminders.jsonl"
+# Journal fields kept on history messages that are not chat answers
+MESSAGE_MARKERS = ("tasks", "reminders")
+# Missed reminders beyond this many are announced as one summary
+REMINDER_CATCH_UP_LIMIT = 5
+# A reminder whose announcement failed is tried again after this many seconds
+REMINDER_RETRY_SECONDS = 60
+IMAGE_GENERATION_URL = env_vars.get("ImageGenerationURL", "https://image.pollinations.ai/prompt/{prompt}")
+
+# Model routing
+FAST_MODEL = env_vars.get("FastModel", "llama-3.1-8b-instant" if LLM_PROVIDER == "groq" else LLM_MODEL)
+QUALITY_MAX_TOKENS = int(env_vars.get("QualityMaxTokens", 1024))
+FAST_MAX_TOKENS = int(env_vars.get("FastMaxTokens", 256))
+VOICE_MAX_TOKENS = int(env_vars.get("VoiceMaxTokens", 300))
+ROUTER_SIMPLE_MAX_WORDS = int(env_vars.get("RouterSimpleMaxWords", 8))
+ROUTER_LATENCY_WINDOW = 200
+SMALL_TALK_PATTERN = re.compile(
+    r"^(hi|hii+|hello|hey|yo|thanks|thank you|thx|ok|okay|cool|nice|great|good (morning|afternoon|evening|night)|"
+    r"bye|goodbye|see you|how are you|who are you|what is your name|yes|no|sure)\b", re.IGNORECASE)
+HARD_QUERY_PATTERN = re.compile(
+    r"\b(explain|why|how does|compare|difference|analy[sz]e|write|code|program|function|debug|calculate|solve|"
+    r"prove|step by step|essay|summari[sz]e|translate|plan|design)\b|\d+\s*[-+*/^]\s*\d+", re.IGNORECASE)
+
+# Speech recognition
+# Longest a transcript long-poll waits in the page before returning empty
+VOICE_RESULT_WAIT_MS = 5000
+VOICE_IDLE_SHUTDOWN = float(env_vars.get("VoiceIdleShutdown", 300))
+VOICE_WATCHDOG_INTERVAL = 2.0
+VOICE_RESTART_MAX_BACKOFF = 60
+CHROMEDRIVER_CACHE_PATH = "Data/ChromeDriver.json"
+# chrome, local (microphone + Vosk) or wav (replay SpeechReplayPath)
+SPEECH_RECOGNIZER = env_vars.get("SpeechRecognizer", "chrome").lower()
+VOSK_MODEL_PATH = env_vars.get("VoskModelPath", "Data/vosk-model")
+SPEECH_SAMPLE_RATE = 16000
+SPEECH_CHUNK_SECONDS = 0.1
+SPEECH_REPLAY_PATH = env_vars.get("SpeechReplayPath", "Data/replay.wav")
+# 1.0 replays in real time, 0 as fast as possible
+SPEECH_REPLAY_SPEED = float(env_vars.get("SpeechReplaySpeed", 1.0))
+# End-of-utterance detection
+VOICE_SILENCE_MS = int(env_vars.get("VoiceSilenceMs", 700))
+VOICE_MAX_UTTERANCE_SECONDS = float(env_vars.get("VoiceMaxUtteranceSeconds", 15))
+VOICE_FINAL_ENDS_UTTERANCE = env_vars.get("VoiceFinalEndsUtterance", "true").lower() in ("1", "true", "yes")
+VOICE_HANDS_FREE = env_vars.get("VoiceHandsFree", "false").lower() in ("1", "true", "yes")
+# Words heard during playback before the user interrupts the assistant; 0 ignores speech while it talks
+VOICE_BARGE_IN_WORDS = int(env_vars.get("VoiceBargeInWords", 2))
+
+# Text-to-speech
+TTS_PITCH = "+5Hz"
+# edge-tts streams 24 kHz mono MP3; a matching mixer avoids resampling seams between segments
+TTS_SAMPLE_RATE = 24000
+TTS_RATE = "+13%"
+# The first segment is small so playback starts early; later ones are larger to keep seams rare
+TTS_FIRST_SEGMENT_BYTES = 3000
+TTS_SEGMENT_BYTES = 24000
+# Layer III frames borrow bits from up to ~511 bytes of earlier frames, so segments overlap by this many frames
+MP3_OVERLAP_FRAMES = 4
+MP3_BITRATES = {
+    "1": [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    "2": [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]
+}
+MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+# Answers are spoken sentence by sentence; long sentences are cut at clause breaks
+TTS_FIRST_CHUNK_CHARS = int(env_vars.get("TTSFirstChunkChars", 60))
+TTS_MAX_CHUNK_CHARS = int(env_vars.get("TTSMaxChunkChars", 200))
+# Sentences synthesized at once while an earlier one plays
+TTS_SYNTH_CONCURRENCY = int(env_vars.get("TTSSynthConcurrency", 2))
+# Queued utterances play lowest priority first, then in arrival order
+SPEECH_PRIORITY_REMINDER = 0
+SPEECH_PRIORITY_ANSWER = 1
+# Synthesized chunks are cached on disk by text and voice settings
+TTS_CACHE_DIR = env_vars.get("TTSCacheDir", "Data/TTSCache")
+TTS_CACHE_MAX_MB = float(env_vars.get("TTSCacheMaxMB", 50))
+# Phrases synthesized ahead of time once voice mode is used, separated by |
+TTS_WARM_UP_PHRASES = [p.strip() for p in env_vars.get(
+    "TTSWarmUpPhrases",
+    "Hello! How can I help you today?|Sure.|Okay.|Done.|You're welcome!|"
+    "Sorry, I couldn't do that.|Is there anything else I can help you with?"
+).split("|") if p.strip()]
+# Warm-up waits this long between checks for the assistant to be idle
+TTS_WARM_UP_IDLE_SECONDS = float(env_vars.get("TTSWarmUpIdleSeconds", 3))
+
+# Local knowledge base for retrieval-augmented answers
+KNOWLEDGE_DIR = env_vars.get("KnowledgeDir", "Data/Knowledge")
+KNOWLEDGE_DB_PATH = "Data/Knowledge.db"
+KNOWLEDGE_EXTENSIONS = (".txt", ".md", ".markdown", ".html", ".htm")
+KNOWLEDGE_TOP_K = int(env_vars.get("KnowledgeTopK", 4))
+KNOWLEDGE_PASSAGE_WORDS = int(env_vars.get("KnowledgePassageWords", 150))
+KNOWLEDGE_WORKERS = int(env_vars.get("KnowledgeWorkers", 4))
+KNOWLEDGE_BATCH_SIZE = 200
+# Query terms are kept rarest first until their postings add up to this, bounding query time
+KNOWLEDGE_MAX_POSTINGS = int(env_vars.get("KnowledgeMaxPostings", 10000))
+# Passage rowids are document_id * KNOWLEDGE_MAX_PASSAGES + n, so a document's passages are one rowid range
+KNOWLEDGE_MAX_PASSAGES = 10000
+KNOWLEDGE_STOPWORDS = set("""
+a an and are as at be but by do does for from has have how i in is it me my of on or our so that the their
+them there these they this to was we were what when where which who why will with you your about can tell
+""".split())
+
+# Conversation journal settings
+CHAT_LOG_PATH = "Data/ChatLog.json"
+CHAT_JOURNAL_PATH = "Data/ChatLog.jsonl"
+JOURNAL_FSYNC_EVERY = int(env_vars.get("JournalFsyncEvery", 16))
+JOURNAL_FSYNC_INTERVAL = float(env_vars.get("JournalFsyncInterval", 1.0))
+
+# Searchable conversation store
+CHAT_DB_PATH = "Data/ChatStore.db"
+SEARCH_RESULT_LIMIT = int(env_vars.get("SearchResultLimit", 50))
+
+# Prompt context window
+CONTEXT_TOKEN_BUDGET = int(env_vars.get("ContextTokenBudget", 6000))
+MESSAGE_TOKEN_OVERHEAD = 4  # role and separator tokens per chat message
+
+# Rolling summaries of older turns
+SUMMARY_PATH = "Data/Summaries.jsonl"
+SUMMARY_MODEL = env_vars.get("SummaryModel", "llama-3.1-8b-instant" if LLM_PROVIDER == "groq" else LLM_MODEL)
+SUMMARY_IDLE_SECONDS = float(env_vars.get("SummaryIdleSeconds", 20))
+SUMMARY_KEEP_MESSAGES = int(env_vars.get("SummaryKeepMessages", 12))
+SUMMARY_MIN_BATCH = int(env_vars.get("SummaryMinBatch", 8))
+SUMMARY_CHUNK_TOKENS = int(env_vars.get("SummaryChunkTokens", 3000))
+
+# Streaming responses
+STREAM_RESPONSES = env_vars.get("StreamResponses", "true").lower() in ("1", "true", "yes")
+STREAM_UI_INTERVAL_MS = int(env_vars.get("StreamUIIntervalMs", 50))
+END_OF_SEQUENCE = "</s>"
+
+# Response cache for repeated prompts
+RESPONSE_CACHE_PATH = "Data/ResponseCache.db"
+RESPONSE_CACHE_MAX_ENTRIES = int(env_vars.get("ResponseCacheMaxEntries", 2000))
+RESPONSE_CACHE_TTL = float(env_vars.get("ResponseCacheTTL", 7 * 24 * 3600))
+REALTIME_QUERY_PATTERN = re.compile(
+    r"\b(today|tonight|now|current|currently|latest|recent|news|weather|forecast|price|stock|score|live|"
+    r"time|date|yesterday|tomorrow|this (week|month|year))\b", re.IGNORECASE)
+SEMANTIC_CACHE_DIM = int(env_vars.get("SemanticCacheDim", 512))
+SEMANTIC_CACHE_THRESHOLD = float(env_vars.get("SemanticCacheThreshold", 0.9))
+FOLLOW_UP_QUERY_PATTERN = re.compile(
+    r"\b(it|its|that|this|these|those|them|he|she|they|his|her|their|more|again|above|previous|continue|"
+    r"elaborate|explain further)\b", re.IGNORECASE)
+
 # Cyberpunk Neon Theme Colors
 CYBERPUNK_COLORS = {
     "background": "#0a0a12",
@@ -41,13 +269,3204 @@ CYBERPUNK_COLORS = {
     "error": "#ff3864"
 }
 
-# Initialize Groq client
-client = Groq(api_key=GroqAPIKEY) if GroqAPIKEY else None
-cohere_client = CohereClient(api_key=CohereAPIKey) if CohereAPIKey else None
+class CancelToken:
+    """Thread-safe cancellation flag that also closes in-flight resources"""
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.callbacks = []
+    
+    def cancel(self):
+        """Mark as cancelled and run every registered close callback once"""
+        with self.lock:
+            if self.event.is_set():
+                return
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+    
+    def is_cancelled(self):
+        return self.event.is_set()
+    
+    def on_cancel(self, callback):
+        """Register a callback, running it immediately if already cancelled"""
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+        callback()
+
+class LLMProvider:
+    """Common interface for chat completion backends"""
+    name = "base"
+    
+    def stream(self, model, messages, cancel=None, **params):
+        """Yield the response text in chunks as it is generated; cancel closes the stream"""
+        raise NotImplementedError
+    
+    def complete(self, model, messages, **params):
+        """Return the whole response text"""
+        return "".join(self.stream(model, messages, **params))
+    
+    def close(self):
+        """Release any resources held by the backend"""
+
+class GroqProvider(LLMProvider):
+    """Groq cloud backend using the official SDK over the shared connection pool"""
+    name = "groq"
+    
+    def __init__(self, api_key, http_client):
+        # Retries are left to the hedging/failover layer so errors surface quickly
+        self.client = Groq(api_key=api_key, http_client=http_client, max_retries=0)
+    
+    def stream(self, model, messages, cancel=None, **params):
+        stream = self.client.chat.completions.create(model=model, messages=messages, stream=True, **params)
+        if cancel:
+            cancel.on_cancel(stream.close)
+        try:
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        finally:
+            # Closing the stream releases the HTTP connection back to the pool
+            stream.close()
+    
+    def complete(self, model, messages, **params):
+        completion = self.client.chat.completions.create(model=model, messages=messages, stream=False, **params)
+        return completion.choices[0].message.content or ""
+
+class OpenAICompatibleProvider(LLMProvider):
+    """Any server speaking the OpenAI chat completions API, e.g. a local llama.cpp, vLLM or Ollama"""
+    name = "openai"
+    
+    def __init__(self, base_url, api_key, http_client):
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.http_client = http_client
+    
+    def stream(self, model, messages, cancel=None, **params):
+        payload = {"model": model, "messages": messages, "stream": True, **params}
+        with self.http_client.stream("POST", self.url, json=payload, headers=self.headers) as response:
+            if cancel:
+                cancel.on_cancel(response.close)
+            if response.is_error:
+                response.read()
+                response.raise_for_status()
+            
+            # Server-sent events: one "data: {...}" line per chunk
+            for line in response.iter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or [{}]
+                delta = choices[0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+    
+    def complete(self, model, messages, **params):
+        payload = {"model": model, "messages": messages, "stream": False, **params}
+        response = self.http_client.post(self.url, json=payload, headers=self.headers)
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"] or ""
+
+class MockProvider(LLMProvider):
+    """In-process backend with configurable latency and token rate for offline benchmarking"""
+    name = "mock"
+    
+    def __init__(self, first_token_latency=MOCK_FIRST_TOKEN_LATENCY, tokens_per_second=MOCK_TOKENS_PER_SECOND):
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+    
+    def stream(self, model, messages, cancel=None, **params):
+        question = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        words = f"This is a mock reply from {model} to: {question}".split()
+        words = words[:params.get("max_tokens", len(words))]
+        cancel = cancel or CancelToken()
+        
+        if cancel.event.wait(self.first_token_latency):
+            return
+        for index, word in enumerate(words):
+            if index and cancel.event.wait(1 / self.tokens_per_second):
+                return
+            yield word if index == 0 else " " + word
+
+def create_provider(kind, http_client):
+    """Build the configured LLM backend, or None if it lacks credentials"""
+    if kind == "mock":
+        return MockProvider()
+    if kind == "openai":
+        return OpenAICompatibleProvider(LLM_BASE_URL, LLM_API_KEY, http_client)
+    return GroqProvider(GroqAPIKEY, http_client) if GroqAPIKEY else None
+
+def percentile(values, q):
+    """Return the q-th percentile (0-100) of a sequence, or None if it is empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+class ModelRouter:
+    """Send simple turns to a fast small model and hard ones to the large model"""
+    def __init__(self):
+        self.routes = {
+            "fast": {"name": "fast", "model": FAST_MODEL, "max_tokens": FAST_MAX_TOKENS},
+            "quality": {"name": "quality", "model": LLM_MODEL, "max_tokens": QUALITY_MAX_TOKENS}
+        }
+        self.lock = threading.Lock()
+        self.latencies = {name: deque(maxlen=ROUTER_LATENCY_WINDOW) for name in self.routes}
+        self.first_token_latencies = {name: deque(maxlen=ROUTER_LATENCY_WINDOW) for name in self.routes}
+    
+    def route(self, query, category=None, voice_mode=False):
+        """Choose a route from cheap local features of the query"""
+        words = len(query.split())
+        if category and not category.startswith(("general", "exit")):
+            name, reason = "quality", f"category {category.split()[0]}"
+        elif HARD_QUERY_PATTERN.search(query):
+            name, reason = "quality", "hard query"
+        elif SMALL_TALK_PATTERN.match(query.strip()):
+            name, reason = "fast", "small talk"
+        elif words <= ROUTER_SIMPLE_MAX_WORDS:
+            name, reason = "fast", f"{words} words"
+        else:
+            name, reason = "quality", f"{words} words"
+        
+        route = dict(self.routes[name], reason=reason)
+        
+        # Spoken answers are kept short regardless of the model
+        if voice_mode:
+            route["max_tokens"] = min(route["max_tokens"], VOICE_MAX_TOKENS)
+            route["reason"] += ", voice"
+        return route
+    
+    def record(self, route_name, latency_ms, ttft_ms=None):
+        """Track observed latency per route"""
+        with self.lock:
+            self.latencies[route_name].append(latency_ms)
+            if ttft_ms is not None:
+                self.first_token_latencies[route_name].append(ttft_ms)
+    
+    def stats(self):
+        """Return request counts and latency percentiles per route"""
+        with self.lock:
+            return {
+                name: {
+                    "count": len(self.latencies[name]),
+                    "p50_ms": percentile(self.latencies[name], 50),
+                    "p95_ms": percentile(self.latencies[name], 95),
+                    "ttft_p50_ms": percentile(self.first_token_latencies[name], 50)
+                }
+                for name in self.routes
+            }
+
+class CircuitBreaker:
+    """Skip a failing backend for a cooldown period, then let a single trial request through"""
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+    
+    def allow(self):
+        """Return True if a request may be sent to the backend now"""
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = "half_open"
+                return True
+            return False
+    
+    def record_success(self):
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+    
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+    
+    def record_cancelled(self):
+        """A cancelled trial proves nothing either way, so wait out another cooldown before the next one"""
+        with self.lock:
+            if self.state == "half_open":
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+class HedgingExecutor:
+    """Hedge slow requests with a backup backend and fail over on errors, per-backend circuit breakers"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.breakers = {}
+        self.first_token_latencies = {}
+    
+    def breaker(self, key):
+        with self.lock:
+            if key not in self.breakers:
+                self.breakers[key] = CircuitBreaker()
+                self.first_token_latencies[key] = deque(maxlen=ROUTER_LATENCY_WINDOW)
+            return self.breakers[key]
+    
+    def hedge_delay(self, key):
+        """Seconds to wait for a first token before firing a backup request"""
+        with self.lock:
+            samples = list(self.first_token_latencies.get(key, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, percentile(samples, HEDGE_PERCENTILE) / 1000))
+    
+    def record_first_token(self, key, ttft_ms):
+        self.breaker(key).record_success()
+        with self.lock:
+            self.first_token_latencies[key].append(ttft_ms)
+    
+    def request(self, backends, messages, params, cancel=None):
+        """Start a hedged streaming request over backends in priority order"""
+        return HedgedRequest(self, backends, messages, params, cancel or CancelToken())
+
+class HedgedRequest:
+    """Iterate the text of whichever backend produces a first token first; the losers are cancelled"""
+    def __init__(self, executor, backends, messages, params, cancel):
+        self.executor = executor
+        self.pending = list(backends)
+        self.messages = messages
+        self.params = params
+        self.cancel = cancel
+        self.events = queue.Queue()
+        self.attempts = {}
+        self.backend = None
+    
+    def launch(self):
+        """Start the next backend whose circuit breaker allows it; return it, or None if none is left"""
+        while self.pending:
+            backend = self.pending.pop(0)
+            if not self.executor.breaker(backend["key"]).allow():
+                print(f"Skipping {backend['key']}: circuit open")
+                continue
+            token = CancelToken()
+            self.attempts[backend["key"]] = token
+            threading.Thread(target=self.run_attempt, args=(backend, token, time.perf_counter()), daemon=True).start()
+            return backend
+        return None
+    
+    def run_attempt(self, backend, token, started):
+        """Pump one backend's stream into the shared event queue"""
+        first = True
+        breaker = self.executor.breaker(backend["key"])
+        try:
+            for delta in backend["provider"].stream(backend["model"], self.messages, cancel=token, **self.params):
+                if token.is_cancelled():
+                    break
+                if first:
+                    first = False
+                    self.executor.record_first_token(backend["key"], (time.perf_counter() - started) * 1000)
+                self.events.put((backend, "delta", delta))
+            if token.is_cancelled():
+                # Lost the hedge race or stopped by the user before it answered
+                if first:
+                    breaker.record_cancelled()
+                return
+            if first:
+                breaker.record_success()
+            self.events.put((backend, "done", None))
+        except Exception as e:
+            # Errors caused by our own cancellation are not the backend's fault
+            if token.is_cancelled():
+                if first:
+                    breaker.record_cancelled()
+            else:
+                breaker.record_failure()
+                self.events.put((backend, "error", e))
+    
+    def cancel_attempts(self, keep=None):
+        for key, token in self.attempts.items():
+            if key != keep:
+                token.cancel()
+    
+    def on_cancelled(self):
+        """Close every attempt and wake the consumer"""
+        self.cancel_attempts()
+        self.events.put((None, "cancelled", None))
+    
+    def __iter__(self):
+        self.cancel.on_cancel(self.on_cancelled)
+        try:
+            yield from self.race()
+        finally:
+            # Also covers a consumer that stops iterating early
+            self.cancel_attempts(keep=self.backend["key"] if self.backend else None)
+    
+    def race(self):
+        primary = self.launch()
+        if primary is None:
+            raise RuntimeError("All LLM backends are unavailable (circuits open)")
+        
+        active = 1
+        hedged = not HEDGE_REQUESTS
+        delay = self.executor.hedge_delay(primary["key"])
+        deadline = time.monotonic() + delay
+        
+        # Race until some backend produces its first token
+        while self.backend is None:
+            timeout = max(0.0, deadline - time.monotonic()) if not hedged else None
+            try:
+                backend, kind, payload = self.events.get(timeout=timeout)
+            except queue.Empty:
+                hedged = True
+                if self.launch():
+                    active += 1
+                    print(f"Hedging: no first token from {primary['key']} after {delay:.1f}s, backup request sent")
+                continue
+            
+            if kind == "cancelled":
+                return
+            if kind == "error":
+                print(f"Backend {backend['key']} failed: {payload}")
+                active -= 1
+                if active == 0:
+                    # Fail over straight away and give the replacement a fresh hedge deadline
+                    primary = self.launch()
+                    if primary is None:
+                        raise payload
+                    active = 1
+                    delay = self.executor.hedge_delay(primary["key"])
+                    deadline = time.monotonic() + delay
+                continue
+            
+            self.backend = backend
+            self.cancel_attempts(keep=backend["key"])
+            if kind == "done":
+                return
+            yield payload
+        
+        # Relay the winner only; events from cancelled attempts are ignored
+        while True:
+            backend, kind, payload = self.events.get()
+            if kind == "cancelled":
+                return
+            if backend is not self.backend:
+                continue
+            if kind == "delta":
+                yield payload
+            elif kind == "error":
+                raise payload
+            else:
+                return
+
+# Shared keep-alive connection pool for every HTTP API
+http_client = httpx.Client(
+    timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+    limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS, keepalive_expiry=60)
+)
+
+# Initialize LLM and decision-making clients
+llm = create_provider(LLM_PROVIDER, http_client)
+fallback_llm = create_provider(FALLBACK_PROVIDER, http_client) if FALLBACK_PROVIDER else None
+cohere_client = CohereClient(api_key=CohereAPIKey, httpx_client=http_client, timeout=HTTP_TIMEOUT) if CohereAPIKey and LLM_PROVIDER != "mock" else None
+
+# Create necessary directories
+os.makedirs("Data", exist_ok=True)
+os.makedirs("Frontend/Files", exist_ok=True, mode=0o777)
+
+class ConversationJournal:
+    """Append-only JSONL journal holding one record per chat message"""
+    def __init__(self, path, legacy_path=None, fsync_every=JOURNAL_FSYNC_EVERY, fsync_interval=JOURNAL_FSYNC_INTERVAL):
+        self.path = path
+        self.fsync_every = max(1, fsync_every)
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.sync_timer = None
+        self.next_seq = 0
+        
+        # One-time migration from the old whole-file JSON log
+        if legacy_path and not os.path.exists(path) and os.path.exists(legacy_path):
+            self.migrate(legacy_path)
+        
+        self.repair_tail()
+        self.file = open(path, "a", encoding="utf-8")
+    
+    def migrate(self, legacy_path):
+        """Convert a legacy ChatLog.json list into the journal format"""
+        try:
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                messages = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Journal migration skipped: {e}")
+            return
+        
+        # Write to a temporary file first so a crash never leaves a half-migrated journal
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for seq, message in enumerate(messages):
+                record = {"seq": seq, "ts": None, "role": message.get("role"), "content": message.get("content", "")}
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        os.replace(legacy_path, legacy_path + ".migrated")
+        print(f"Migrated {len(messages)} messages from {legacy_path} to {self.path}")
+    
+    def repair_tail(self):
+        """Drop a partially written last line left behind by a crash"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            
+            # Scan backwards for the last complete record
+            pos = size
+            while pos > 0:
+                step = min(4096, pos)
+                pos -= step
+                f.seek(pos)
+                newline = f.read(step).rfind(b"\n")
+                if newline != -1:
+                    f.truncate(pos + newline + 1)
+                    return
+            f.truncate(0)
+    
+    def load(self):
+        """Read every journal record back in order"""
+        records = []
+        with self.lock, open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        if records:
+            self.next_seq = records[-1].get("seq", len(records) - 1) + 1
+        return records
+    
+    def append(self, role, content, **extra):
+        """Append a single message record; cost is independent of history length"""
+        with self.lock:
+            record = {"seq": self.next_seq, "ts": time.time(), "role": role, "content": content}
+            record.update(extra)
+            self.next_seq += 1
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.file.flush()
+            self.pending += 1
+            
+            # Batch fsyncs: sync on count, otherwise make sure a timer will sync soon
+            if self.pending >= self.fsync_every:
+                self.sync_locked()
+            elif self.sync_timer is None:
+                self.sync_timer = threading.Timer(self.fsync_interval, self.sync)
+                self.sync_timer.daemon = True
+                self.sync_timer.start()
+        return record
+    
+    def sync(self):
+        """Flush pending records to stable storage"""
+        with self.lock:
+            self.sync_locked()
+    
+    def sync_locked(self):
+        if self.sync_timer is not None:
+            self.sync_timer.cancel()
+            self.sync_timer = None
+        if self.pending and not self.file.closed:
+            os.fsync(self.file.fileno())
+            self.pending = 0
+    
+    def compact(self, records):
+        """Atomically replace the journal with the given records"""
+        with self.lock:
+            self.sync_locked()
+            self.file.close()
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self.file = open(self.path, "a", encoding="utf-8")
+    
+    def close(self):
+        """Sync and close the journal file"""
+        with self.lock:
+            self.sync_locked()
+            self.file.close()
+
+class ConversationStore:
+    """SQLite conversation store with an FTS5 full-text index over every message"""
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.create_schema()
+    
+    def create_schema(self):
+        """Create tables, indexes and the external-content FTS5 index"""
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id TEXT PRIMARY KEY,
+                    started_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY,
+                    seq INTEGER UNIQUE,
+                    session_id TEXT,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    ts REAL,
+                    model TEXT,
+                    latency_ms REAL
+                );
+                CREATE INDEX IF NOT EXISTS messages_session ON messages(session_id, id);
+                CREATE INDEX IF NOT EXISTS messages_ts ON messages(ts);
+            """)
+            
+            # FTS5 is compiled into almost every SQLite build, but fall back to LIKE if not
+            try:
+                self.conn.executescript("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                        content, content='messages', content_rowid='id',
+                        tokenize='unicode61 remove_diacritics 2'
+                    );
+                    CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+                        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+                        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE ON messages BEGIN
+                        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+                    END;
+                """)
+                self.has_fts = True
+            except sqlite3.OperationalError as e:
+                print(f"FTS5 unavailable, falling back to LIKE search: {e}")
+                self.has_fts = False
+    
+    def start_session(self):
+        """Register a new chat session and return its id"""
+        session_id = uuid.uuid4().hex
+        with self.lock, self.conn:
+            self.conn.execute("INSERT INTO sessions (id, started_at) VALUES (?, ?)", (session_id, time.time()))
+        return session_id
+    
+    def add_message(self, role, content, session_id=None, seq=None, ts=None, model=None, latency_ms=None):
+        """Insert a single message"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO messages (seq, session_id, role, content, ts, model, latency_ms) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (seq, session_id, role, content, ts if ts is not None else time.time(), model, latency_ms)
+            )
+    
+    def last_seq(self):
+        """Return the highest journal sequence number already stored"""
+        with self.lock:
+            row = self.conn.execute("SELECT MAX(seq) FROM messages").fetchone()
+        return -1 if row[0] is None else row[0]
+    
+    def import_records(self, records):
+        """Backfill journal records that are not in the store yet"""
+        last_seq = self.last_seq()
+        rows = [
+            (r["seq"], r.get("session", "legacy"), r["role"], r["content"], r.get("ts"), r.get("model"), r.get("latency_ms"))
+            for r in records
+            if r.get("seq", -1) > last_seq and r.get("role") in ("user", "assistant")
+        ]
+        if not rows:
+            return 0
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO sessions (id, started_at) VALUES ('legacy', NULL)")
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO messages (seq, session_id, role, content, ts, model, latency_ms) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+        return len(rows)
+    
+    @staticmethod
+    def build_match_query(query):
+        """Turn free text into a safe FTS5 query with prefix matching on the last word"""
+        terms = ['"' + term.replace('"', '""') + '"' for term in query.split()]
+        if terms:
+            terms[-1] += "*"
+        return " ".join(terms)
+    
+    def search(self, query, limit=SEARCH_RESULT_LIMIT, role=None, session_id=None):
+        """Full-text search over all stored messages, best matches first"""
+        query = query.strip()
+        if not query:
+            return []
+        
+        filters, params = [], []
+        if role:
+            filters.append("m.role = ?")
+            params.append(role)
+        if session_id:
+            filters.append("m.session_id = ?")
+            params.append(session_id)
+        
+        if self.has_fts:
+            where = " AND ".join(["messages_fts MATCH ?"] + filters)
+            sql = f"""
+                SELECT m.id, m.session_id, m.role, m.ts, m.model, m.latency_ms,
+                       snippet(messages_fts, 0, '[', ']', '...', 16) AS snippet
+                FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+                WHERE {where}
+                ORDER BY bm25(messages_fts) LIMIT ?
+            """
+            params = [self.build_match_query(query)] + params + [limit]
+        else:
+            where = " AND ".join(["m.content LIKE ?"] + filters)
+            sql = f"""
+                SELECT m.id, m.session_id, m.role, m.ts, m.model, m.latency_ms, substr(m.content, 1, 160) AS snippet
+                FROM messages m WHERE {where} ORDER BY m.id DESC LIMIT ?
+            """
+            params = [f"%{query}%"] + params + [limit]
+        
+        with self.lock:
+            try:
+                return [dict(row) for row in self.conn.execute(sql, params)]
+            except sqlite3.OperationalError as e:
+                print(f"Search error: {e}")
+                return []
+    
+    def get_messages(self, session_id=None, limit=100, before_id=None):
+        """Page through messages, newest first, optionally within one session"""
+        filters, params = [], []
+        if session_id:
+            filters.append("session_id = ?")
+            params.append(session_id)
+        if before_id is not None:
+            filters.append("id < ?")
+            params.append(before_id)
+        where = f"WHERE {' AND '.join(filters)}" if filters else ""
+        with self.lock:
+            rows = self.conn.execute(f"SELECT * FROM messages {where} ORDER BY id DESC LIMIT ?", params + [limit])
+            return [dict(row) for row in rows]
+    
+    def get_sessions(self):
+        """List sessions with their message counts, newest first"""
+        with self.lock:
+            rows = self.conn.execute("""
+                SELECT s.id, s.started_at, COUNT(m.id) AS message_count
+                FROM sessions s LEFT JOIN messages m ON m.session_id = s.id
+                GROUP BY s.id ORDER BY s.started_at DESC
+            """)
+            return [dict(row) for row in rows]
+    
+    def close(self):
+        """Close the database connection"""
+        with self.lock:
+            self.conn.close()
+
+class TextExtractor(HTMLParser):
+    """Collect the visible text and title of an HTML page"""
+    SKIP_TAGS = {"script", "style", "noscript", "template", "svg"}
+    
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.title = ""
+        self.stack = []
+    
+    def handle_starttag(self, tag, attrs):
+        self.stack.append(tag)
+    
+    def handle_endtag(self, tag):
+        if tag in self.stack:
+            while self.stack.pop() != tag:
+                pass
+    
+    def handle_data(self, data):
+        if self.stack and self.stack[-1] == "title":
+            self.title += data
+        elif not self.SKIP_TAGS.intersection(self.stack):
+            self.parts.append(data)
+
+class KnowledgeBase:
+    """Local document corpus in an incrementally updated on-disk FTS5 index ranked with BM25"""
+    def __init__(self, path, root=KNOWLEDGE_DIR):
+        self.root = root
+        self.lock = threading.Lock()
+        self.index_lock = threading.Lock()
+        self.stopped = False
+        self.write_conn = sqlite3.connect(path, check_same_thread=False)
+        self.write_conn.execute("PRAGMA journal_mode=WAL")
+        self.write_conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            with self.write_conn:
+                self.write_conn.executescript("""
+                    CREATE TABLE IF NOT EXISTS documents (
+                        id INTEGER PRIMARY KEY,
+                        path TEXT UNIQUE NOT NULL,
+                        title TEXT,
+                        mtime REAL,
+                        size INTEGER,
+                        passages INTEGER
+                    );
+                    CREATE VIRTUAL TABLE IF NOT EXISTS passages USING fts5(
+                        content, tokenize='unicode61 remove_diacritics 2'
+                    );
+                    CREATE TABLE IF NOT EXISTS terms (
+                        term TEXT PRIMARY KEY,
+                        df INTEGER NOT NULL
+                    ) WITHOUT ROWID;
+                """)
+            self.available = True
+        except sqlite3.OperationalError as e:
+            print(f"FTS5 unavailable, knowledge base disabled: {e}")
+            self.available = False
+        
+        # Searches use their own connection so they never wait for an indexing batch
+        self.read_conn = sqlite3.connect(path, check_same_thread=False)
+        self.total_passages = self.count_passages() if self.available else 0
+    
+    def count_passages(self):
+        return self.write_conn.execute("SELECT COALESCE(SUM(passages), 0) FROM documents").fetchone()[0]
+    
+    @staticmethod
+    def tokenize(text):
+        """Approximate the FTS5 unicode61 tokenizer: lowercase, no diacritics, alphanumeric runs"""
+        text = unicodedata.normalize("NFKD", text.lower())
+        if not text.isascii():
+            text = "".join(c for c in text if not unicodedata.combining(c))
+        return re.findall(r"[^\W_]+", text)
+    
+    @classmethod
+    def count_terms(cls, passages):
+        """Number of passages each term appears in"""
+        counts = Counter()
+        for passage in passages:
+            counts.update(set(cls.tokenize(passage)))
+        return counts
+    
+    @classmethod
+    def read_document(cls, path):
+        """Return (title, passages, term counts) for one file; runs on the indexing pool"""
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            text = f.read()
+        title = os.path.splitext(os.path.basename(path))[0]
+        
+        if path.lower().endswith((".html", ".htm")):
+            extractor = TextExtractor()
+            extractor.feed(text)
+            title = " ".join(extractor.title.split()) or title
+            text = " ".join(extractor.parts)
+        else:
+            heading = re.search(r"^#\s+(.+)$", text, re.MULTILINE)
+            if heading:
+                title = heading.group(1).strip()
+        
+        # Fixed-size word windows keep BM25 length normalization meaningful
+        words = text.split()
+        size = KNOWLEDGE_PASSAGE_WORDS
+        passages = [" ".join(words[i:i + size]) for i in range(0, len(words), size)][:KNOWLEDGE_MAX_PASSAGES]
+        return title, passages, cls.count_terms(passages)
+    
+    def scan(self):
+        """Yield (path, mtime, size) for every supported file under the root"""
+        stack = [self.root]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.lower().endswith(KNOWLEDGE_EXTENSIONS):
+                    stat = entry.stat()
+                    yield entry.path, stat.st_mtime, stat.st_size
+    
+    def index(self):
+        """Bring the index in step with the folder: new and changed files are parsed in parallel, removed ones dropped"""
+        if not self.available or not os.path.isdir(self.root):
+            return
+        with self.index_lock:
+            started = time.perf_counter()
+            known = {
+                path: (doc_id, mtime, size)
+                for doc_id, path, mtime, size in self.write_conn.execute("SELECT id, path, mtime, size FROM documents")
+            }
+            seen = set()
+            changed = 0
+            batch = []
+            
+            def changed_files():
+                for path, mtime, size in self.scan():
+                    seen.add(path)
+                    if known.get(path, (None, None, None))[1:] != (mtime, size):
+                        yield path, mtime, size
+            
+            # Stream files through the pool with a bounded number in flight; one thread writes
+            with ThreadPoolExecutor(max_workers=KNOWLEDGE_WORKERS) as pool:
+                in_flight = deque()
+                files = changed_files()
+                while not self.stopped:
+                    for path, mtime, size in files:
+                        in_flight.append((path, mtime, size, pool.submit(self.read_document, path)))
+                        if len(in_flight) >= KNOWLEDGE_WORKERS * 4:
+                            break
+                    if not in_flight:
+                        break
+                    path, mtime, size, future = in_flight.popleft()
+                    try:
+                        title, passages, terms = future.result()
+                    except OSError as e:
+                        print(f"Knowledge base skipped {path}: {e}")
+                        continue
+                    batch.append((path, mtime, size, title, passages, terms))
+                    changed += 1
+                    if len(batch) >= KNOWLEDGE_BATCH_SIZE:
+                        self.write_batch(batch, known)
+                        batch = []
+            self.write_batch(batch, known)
+            if self.stopped:
+                return
+            
+            removed = [known[path][0] for path in known if path not in seen]
+            with self.write_conn:
+                for doc_id in removed:
+                    self.delete_passages(doc_id)
+                self.write_conn.executemany("DELETE FROM documents WHERE id = ?", [(doc_id,) for doc_id in removed])
+                self.write_conn.execute("DELETE FROM terms WHERE df <= 0")
+            
+            self.total_passages = self.count_passages()
+            if changed or removed:
+                print(f"Knowledge base: indexed {changed} files, removed {len(removed)} in {time.perf_counter() - started:.1f}s")
+    
+    def delete_passages(self, doc_id):
+        """Remove a document's passages and their document frequencies"""
+        span = (doc_id * KNOWLEDGE_MAX_PASSAGES, (doc_id + 1) * KNOWLEDGE_MAX_PASSAGES)
+        old = [row[0] for row in self.write_conn.execute("SELECT content FROM passages WHERE rowid >= ? AND rowid < ?", span)]
+        self.add_terms(self.count_terms(old), sign=-1)
+        self.write_conn.execute("DELETE FROM passages WHERE rowid >= ? AND rowid < ?", span)
+    
+    def add_terms(self, counts, sign=1):
+        self.write_conn.executemany(
+            "INSERT INTO terms (term, df) VALUES (?, ?) ON CONFLICT(term) DO UPDATE SET df = df + excluded.df",
+            [(term, sign * count) for term, count in counts.items()]
+        )
+    
+    def write_batch(self, batch, known):
+        """Replace the passages of a batch of documents in one transaction"""
+        if not batch:
+            return
+        with self.write_conn:
+            batch_terms = Counter()
+            for path, mtime, size, title, passages, terms in batch:
+                if path in known:
+                    doc_id = known[path][0]
+                    self.delete_passages(doc_id)
+                    self.write_conn.execute(
+                        "UPDATE documents SET title = ?, mtime = ?, size = ?, passages = ? WHERE id = ?",
+                        (title, mtime, size, len(passages), doc_id)
+                    )
+                else:
+                    doc_id = self.write_conn.execute(
+                        "INSERT INTO documents (path, title, mtime, size, passages) VALUES (?, ?, ?, ?, ?)",
+                        (path, title, mtime, size, len(passages))
+                    ).lastrowid
+                base = doc_id * KNOWLEDGE_MAX_PASSAGES
+                self.write_conn.executemany(
+                    "INSERT INTO passages (rowid, content) VALUES (?, ?)",
+                    [(base + n, passage) for n, passage in enumerate(passages)]
+                )
+                batch_terms.update(terms)
+            self.add_terms(batch_terms)
+    
+    def select_terms(self, query):
+        """Pick the distinctive words of a question, rarest first, within the postings budget"""
+        words = []
+        for word in self.tokenize(query):
+            if len(word) > 1 and word not in KNOWLEDGE_STOPWORDS and word not in words:
+                words.append(word)
+        if not words:
+            return []
+        
+        placeholders = ", ".join("?" * len(words))
+        counts = dict(self.read_conn.execute(f"SELECT term, df FROM terms WHERE term IN ({placeholders})", words).fetchall())
+        # Words never seen while indexing cannot match anything
+        counts = [(word, counts[word]) for word in words if counts.get(word, 0) > 0]
+        
+        terms, postings = [], 0
+        for term, count in sorted(counts, key=lambda row: row[1]):
+            if terms and postings + count > KNOWLEDGE_MAX_POSTINGS:
+                break
+            # A term in more than half the passages has no BM25 weight; only scan for it when that is cheap
+            if count > KNOWLEDGE_MAX_POSTINGS and count * 2 > self.total_passages:
+                break
+            terms.append(term)
+            postings += count
+        return terms
+    
+    def search(self, query, limit=KNOWLEDGE_TOP_K):
+        """Return the best matching passages as dicts with title, path, text and score"""
+        if not self.available:
+            return []
+        started = time.perf_counter()
+        with self.lock:
+            try:
+                # OR the terms together so BM25 can rank partial matches
+                terms = self.select_terms(query)
+                if not terms:
+                    return []
+                match = " OR ".join(f'"{term}"' for term in terms)
+                rows = self.read_conn.execute("""
+                    SELECT p.rowid, p.content, p.score, d.title, d.path
+                    FROM (SELECT rowid, content, rank AS score FROM passages WHERE passages MATCH ? ORDER BY rank LIMIT ?) p
+                    JOIN documents d ON d.id = p.rowid / ?
+                """, (match, limit, KNOWLEDGE_MAX_PASSAGES)).fetchall()
+            except sqlite3.OperationalError as e:
+                print(f"Knowledge search error: {e}")
+                return []
+        results = [{"title": title, "path": path, "text": text, "score": -score} for _, text, score, title, path in rows]
+        print(f"Knowledge search: {len(results)} passages in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return results
+    
+    @staticmethod
+    def format_passages(passages):
+        """Render passages as a system message for the prompt"""
+        lines = ["Relevant passages from the local knowledge base (cite the source title when you use them):"]
+        for number, passage in enumerate(passages, 1):
+            lines.append(f"[{number}] {passage['title']}: {passage['text']}")
+        return {"role": "system", "content": "\n".join(lines)}
+    
+    def close(self):
+        # Let a running index pass stop at the next file
+        self.stopped = True
+        with self.lock:
+            self.read_conn.close()
+        with self.index_lock:
+            self.write_conn.close()
+
+class ContextWindow:
+    """Assemble the prompt for a request within a token budget"""
+    def __init__(self, budget=CONTEXT_TOKEN_BUDGET):
+        self.budget = budget
+    
+    @staticmethod
+    def estimate_tokens(text):
+        """Cheap token estimate: roughly four characters per token for English text"""
+        return (len(text) + 3) // 4 + MESSAGE_TOKEN_OVERHEAD
+    
+    @classmethod
+    def message_tokens(cls, message):
+        """Return the token count for a message, caching it on the message"""
+        tokens = message.get("tokens")
+        if tokens is None:
+            tokens = message["tokens"] = cls.estimate_tokens(message["content"])
+        return tokens
+    
+    def build(self, system_messages, history, summary=None):
+        """Return (messages, stats): system prompt, pinned messages and as many recent turns as fit"""
+        # Turns folded into the running summary are replaced by the summary itself
+        summarized_until = -1
+        if summary:
+            summarized_until = summary["end_seq"]
+            system_messages = system_messages + [{
+                "role": "system",
+                "content": f"Summary of the earlier conversation:\n{summary['summary']}"
+            }]
+        
+        used = sum(self.message_tokens(m) for m in system_messages)
+        selected = set()
+        
+        # The latest turn is always sent, even if it alone exceeds the budget
+        if history:
+            selected.add(len(history) - 1)
+            used += self.message_tokens(history[-1])
+        
+        # Pinned messages come next, newest first
+        for index in range(len(history) - 2, -1, -1):
+            message = history[index]
+            if message.get("pinned") and used + self.message_tokens(message) <= self.budget:
+                selected.add(index)
+                used += self.message_tokens(message)
+        
+        # Then walk back from the newest turn until the budget or the summary is reached
+        for index in range(len(history) - 2, -1, -1):
+            if index in selected:
+                continue
+            if (history[index].get("seq") or 0) <= summarized_until:
+                break
+            tokens = self.message_tokens(history[index])
+            if used + tokens > self.budget:
+                break
+            selected.add(index)
+            used += tokens
+        
+        messages = [{"role": m["role"], "content": m["content"]} for m in system_messages]
+        messages += [{"role": history[i]["role"], "content": history[i]["content"]} for i in sorted(selected)]
+        
+        total = sum(self.message_tokens(m) for m in history)
+        kept = sum(self.message_tokens(history[i]) for i in selected)
+        stats = {
+            "budget": self.budget,
+            "used_tokens": used,
+            "dropped_tokens": total - kept,
+            "dropped_messages": len(history) - len(selected),
+            "summarized_until": summarized_until
+        }
+        return messages, stats
+
+class ConversationSummarizer:
+    """Fold aged-out turns into a running summary during idle time"""
+    def __init__(self, path, idle_seconds=SUMMARY_IDLE_SECONDS):
+        self.path = path
+        self.idle_seconds = idle_seconds
+        self.lock = threading.Lock()
+        self.timer = None
+        self.cancelled = threading.Event()
+        self.current = None
+        
+        # Summaries are append-only; the last record is the current running summary
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self.current = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+    
+    def schedule(self, get_history):
+        """(Re)start the idle timer; the job runs only if nothing else happens first"""
+        self.cancel()
+        self.cancelled.clear()
+        self.timer = threading.Timer(self.idle_seconds, self.run, args=(get_history,))
+        self.timer.daemon = True
+        self.timer.start()
+    
+    def cancel(self):
+        """Stop a pending or running job because the user is active again"""
+        self.cancelled.set()
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+    
+    def pending_messages(self, history):
+        """Return turns that have aged out of the recent window but are not summarized yet"""
+        summarized_until = self.current["end_seq"] if self.current else -1
+        aged = history[:-SUMMARY_KEEP_MESSAGES] if SUMMARY_KEEP_MESSAGES else history
+        return [m for m in aged if (m.get("seq") or 0) > summarized_until]
+    
+    def run(self, get_history):
+        """Fold pending turns into the summary one chunk at a time"""
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            pending = self.pending_messages(list(get_history()))
+            if len(pending) < SUMMARY_MIN_BATCH:
+                return
+            
+            while pending and not self.cancelled.is_set():
+                # Take as many turns as fit in one summarization request
+                chunk, tokens = [], 0
+                for message in pending:
+                    if chunk and tokens + ContextWindow.message_tokens(message) > SUMMARY_CHUNK_TOKENS:
+                        break
+                    chunk.append(message)
+                    tokens += ContextWindow.message_tokens(message)
+                pending = pending[len(chunk):]
+                
+                summary = self.summarize(chunk)
+                if summary is None:
+                    return
+                self.save(summary, chunk[-1]["seq"])
+        finally:
+            self.lock.release()
+    
+    def summarize(self, messages):
+        """Ask a small model to extend the running summary with new turns"""
+        if not llm:
+            return None
+        
+        previous = self.current["summary"] if self.current else "(none yet)"
+        transcript = "\n".join(
+            f"{Username if m['role'] == 'user' else Assistantname}: {m['content']}" for m in messages
+        )
+        try:
+            summary = llm.complete(
+                SUMMARY_MODEL,
+                [
+                    {"role": "system", "content": "You maintain a concise running summary of a conversation. Keep names, facts, preferences, decisions and open questions. Reply with the updated summary only."},
+                    {"role": "user", "content": f"Current summary:\n{previous}\n\nNew turns:\n{transcript}"}
+                ],
+                max_tokens=512,
+                temperature=0.3
+            )
+            return summary.replace(END_OF_SEQUENCE, "").strip()
+        except Exception as e:
+            print(f"Summarization error: {e}")
+            return None
+    
+    def save(self, summary, end_seq):
+        """Append a new summary record covering every turn up to end_seq"""
+        start_seq = self.current["start_seq"] if self.current else 0
+        record = {"start_seq": start_seq, "end_seq": end_seq, "summary": summary, "ts": time.time(), "model": SUMMARY_MODEL}
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.current = record
+        print(f"Summarized turns {start_seq}-{end_seq}")
+
+class StreamSanitizer:
+    """Strip end-of-sequence markers from streamed text, even when split across chunks"""
+    def __init__(self, marker=END_OF_SEQUENCE):
+        self.marker = marker
+        self.held = ""
+    
+    def feed(self, chunk):
+        """Return the text that is safe to show; hold back a possible partial marker"""
+        text = (self.held + chunk).replace(self.marker, "")
+        self.held = ""
+        for size in range(min(len(self.marker) - 1, len(text)), 0, -1):
+            if self.marker.startswith(text[-size:]):
+                self.held = text[-size:]
+                return text[:-size]
+        return text
+    
+    def finish(self):
+        """Release whatever was held back at the end of the stream"""
+        text, self.held = self.held, ""
+        return text
+
+class StreamingMessage:
+    """A live assistant bubble that coalesces streamed text into periodic UI updates"""
+    def __init__(self, app, interval_ms=STREAM_UI_INTERVAL_MS, held=False):
+        self.app = app
+        self.interval_ms = interval_ms
+        self.lock = threading.Lock()
+        self.text = ""
+        # A held message buffers text without showing it until released
+        self.held = held
+        self.update_pending = False
+        self.last_render = 0.0
+        self.bubble = None
+        self.label = None
+        self.speech = None
+    
+    def speak(self, speech):
+        """Forward shown text to a speech pipeline as well"""
+        with self.lock:
+            self.speech = speech
+            if self.text and not self.held:
+                speech.feed(self.text)
+    
+    def append(self, text):
+        """Add streamed text from a worker thread"""
+        if not text:
+            return
+        with self.lock:
+            self.text += text
+            if self.speech and not self.held:
+                self.speech.feed(text)
+            if self.update_pending or self.held:
+                return
+            self.update_pending = True
+        self.app.ui.post(self.flush)
+    
+    def release(self):
+        """Start showing a held message, including the text buffered so far"""
+        with self.lock:
+            self.held = False
+            if self.speech and self.text:
+                self.speech.feed(self.text)
+            if self.update_pending or not self.text:
+                return
+            self.update_pending = True
+        self.app.ui.post(self.flush)
+    
+    def flush(self):
+        """Render pending text at most once per interval; runs on the Tk main thread"""
+        # The first chunk is shown right away, later ones are batched
+        wait_ms = self.interval_ms - (time.monotonic() - self.last_render) * 1000
+        if self.label is not None and wait_ms > 0:
+            self.app.root.after(int(wait_ms), self.flush)
+            return
+        self.render()
+    
+    def render(self):
+        with self.lock:
+            text = self.text
+            self.update_pending = False
+        if self.label is None:
+            self.app.remove_typing_indicator()
+            self.bubble, self.label = self.app.add_message(text, "assistant")
+        else:
+            self.app.update_message(self.label, text)
+        self.last_render = time.monotonic()
+    
+    def stop(self):
+        """Mark a cancelled answer as stopped; runs on the Tk main thread"""
+        with self.lock:
+            self.text = self.text.rstrip() + " ■"
+        if self.label is not None:
+            self.render()
+    
+    def finish(self, text, message):
+        """Show the final text and make the bubble pinnable; runs on the Tk main thread"""
+        with self.lock:
+            self.text = text
+        self.render()
+        self.app.bind_message_pin(self.bubble, self.label, message)
+
+class ResponseCache:
+    """Disk-backed LRU cache with TTL for answers to repeated prompts"""
+    def __init__(self, path, max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    query TEXT,
+                    response TEXT NOT NULL,
+                    model TEXT,
+                    created REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS entries_last_access ON entries(last_access);
+                CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+                INSERT OR IGNORE INTO stats (name, value) VALUES ('hits', 0), ('misses', 0), ('bypasses', 0);
+            """)
+    
+    @staticmethod
+    def normalize(query):
+        """Lowercase, drop punctuation and collapse whitespace so trivial variants share a key"""
+        return " ".join(re.sub(r"[^\w\s]", " ", query.lower()).split())
+    
+    @staticmethod
+    def is_cacheable(query):
+        """Realtime questions and follow-ups that depend on earlier turns are never cached"""
+        return not (REALTIME_QUERY_PATTERN.search(query) or FOLLOW_UP_QUERY_PATTERN.search(query))
+    
+    @classmethod
+    def make_key(cls, query, context, model, params):
+        """Hash the normalized query together with its context, model and sampling parameters"""
+        payload = json.dumps({
+            "query": cls.normalize(query),
+            "context": hashlib.sha256(context.encode("utf-8")).hexdigest(),
+            "model": model,
+            "params": params
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def count(self, name):
+        self.conn.execute("UPDATE stats SET value = value + 1 WHERE name = ?", (name,))
+    
+    def record_bypass(self):
+        """Count a request that skipped the cache"""
+        with self.lock, self.conn:
+            self.count("bypasses")
+    
+    def get(self, key):
+        """Return a fresh cached response or None"""
+        now = time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT response, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.count("misses")
+                return None
+            self.conn.execute("UPDATE entries SET last_access = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self.count("hits")
+            return row[0]
+    
+    def put(self, key, query, response, model):
+        """Store a response and evict the least recently used entries beyond the size bound"""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries (key, query, response, model, created, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, query, response, model, now, now)
+            )
+            overflow = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self.conn.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_access LIMIT ?)",
+                    (overflow,)
+                )
+    
+    def stats(self):
+        """Return hit/miss counters and the current entry count"""
+        with self.lock:
+            stats = dict(self.conn.execute("SELECT name, value FROM stats").fetchall())
+            stats["entries"] = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+    
+    def close(self):
+        """Close the database connection"""
+        with self.lock:
+            self.conn.close()
+
+class SemanticCache:
+    """In-memory similarity index over past (query, answer) pairs using hashed n-gram embeddings"""
+    def __init__(self, dim=SEMANTIC_CACHE_DIM, threshold=SEMANTIC_CACHE_THRESHOLD, capacity=1024):
+        self.dim = dim
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        # Stored feature-major so a lookup only touches the rows of the query's few active features
+        self.matrix = np.zeros((dim, capacity), dtype=np.float32)
+        self.size = 0
+        self.queries = []
+        self.answers = []
+    
+    @staticmethod
+    def features(text):
+        """Return (hashes, weights) for word unigrams, word bigrams and character trigrams"""
+        words = ResponseCache.normalize(text).split()
+        grams = [(w, 1.0) for w in words]
+        grams += [(f"{a} {b}", 1.0) for a, b in zip(words, words[1:])]
+        for word in words:
+            padded = f"#{word}#"
+            grams += [("~" + padded[i:i + 3], 0.5) for i in range(len(padded) - 2)]
+        hashes = np.fromiter((zlib.crc32(g.encode("utf-8")) for g, _ in grams), dtype=np.uint32, count=len(grams))
+        weights = np.fromiter((w for _, w in grams), dtype=np.float32, count=len(grams))
+        return hashes, weights
+    
+    def embed_many(self, texts):
+        """Embed a batch of texts into L2-normalized rows with signed feature hashing"""
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        rows, hashes, weights = [], [], []
+        for row, text in enumerate(texts):
+            h, w = self.features(text)
+            rows.append(np.full(len(h), row, dtype=np.int64))
+            hashes.append(h)
+            weights.append(w)
+        if rows:
+            rows = np.concatenate(rows)
+            hashes = np.concatenate(hashes)
+            weights = np.concatenate(weights)
+            signs = np.where((hashes >> 31) & 1, -1.0, 1.0).astype(np.float32)
+            np.add.at(vectors, (rows, (hashes % self.dim).astype(np.int64)), weights * signs)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-6)
+    
+    def add_many(self, queries, answers):
+        """Append pairs to the index, growing the matrix geometrically"""
+        if not queries:
+            return
+        vectors = self.embed_many(queries)
+        with self.lock:
+            needed = self.size + len(queries)
+            if needed > self.matrix.shape[1]:
+                grown = np.zeros((self.dim, max(needed, self.matrix.shape[1] * 2)), dtype=np.float32)
+                grown[:, :self.size] = self.matrix[:, :self.size]
+                self.matrix = grown
+            self.matrix[:, self.size:needed] = vectors.T
+            self.size = needed
+            self.queries.extend(queries)
+            self.answers.extend(answers)
+    
+    def add(self, query, answer):
+        """Index a single answered query"""
+        self.add_many([query], [answer])
+    
+    def build_from_history(self, history):
+        """Index every cacheable user turn that was followed by an assistant answer"""
+        queries, answers = [], []
+        for message, reply in zip(history, history[1:]):
+            # Task outcomes and reminder announcements are not answers; replaying them would skip the task
+            if reply.get("tasks") or reply.get("reminders"):
+                continue
+            if message["role"] == "user" and reply["role"] == "assistant" and ResponseCache.is_cacheable(message["content"]):
+                queries.append(message["content"])
+                answers.append(reply["content"])
+        self.add_many(queries, answers)
+        return len(queries)
+    
+    def lookup(self, query):
+        """Return (answer, score, matched_query) for the closest past query above the threshold"""
+        vector = self.embed_many([query])[0]
+        with self.lock:
+            if self.size == 0:
+                return None
+            active = np.flatnonzero(vector)
+            scores = vector[active] @ self.matrix[active, :self.size]
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            return self.answers[best], float(scores[best]), self.queries[best]
+
+class UIChannel:
+    """The single thread-safe channel for posting work to the Tk main thread"""
+    def __init__(self, root, interval_ms=UI_POLL_INTERVAL_MS):
+        self.root = root
+        self.interval_ms = interval_ms
+        self.queue = queue.SimpleQueue()
+        self.root.after(interval_ms, self.drain)
+    
+    def post(self, func, *args):
+        """Queue func(*args) to run on the Tk main thread; safe from any thread"""
+        self.queue.put((func, args))
+    
+    def drain(self):
+        """Run everything posted since the last tick"""
+        while True:
+            try:
+                func, args = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"UI update error: {e}")
+        self.root.after(self.interval_ms, self.drain)
+
+class ConversationEngine:
+    """Long-lived asyncio loop on a background thread that owns conversation work"""
+    def __init__(self, limits):
+        self.loop = asyncio.new_event_loop()
+        self.limit_sizes = limits
+        self.limits = {}
+        self.tasks = set()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.run_loop, name="ConversationEngine", daemon=True)
+    
+    def start(self):
+        """Start the loop thread and wait until it is running"""
+        self.thread.start()
+        self.ready.wait()
+    
+    def run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.limits = {name: asyncio.Semaphore(size) for name, size in self.limit_sizes.items()}
+        self.loop.call_soon(self.ready.set)
+        self.loop.run_forever()
+    
+    def submit(self, coro):
+        """Schedule a coroutine from any thread; returns a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+    
+    def spawn(self, coro):
+        """Start a background task from the loop thread, keeping a reference until it is done"""
+        task = self.loop.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+    
+    async def run_blocking(self, kind, func, *args):
+        """Run a blocking call in the executor, bounded by the concurrency limit for its kind"""
+        async with self.limits[kind]:
+            return await self.loop.run_in_executor(None, func, *args)
+    
+    def stop(self):
+        """Cancel outstanding work and stop the loop"""
+        if not self.thread.is_alive():
+            return
+        
+        async def shutdown():
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        
+        try:
+            self.submit(shutdown()).result(timeout=2)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=2)
+
+class RequestQueue:
+    """Strictly ordered per-conversation request queue with cancellation of in-flight work"""
+    def __init__(self, handler, supersede=SUPERSEDE_IN_FLIGHT):
+        self.handler = handler
+        self.supersede = supersede
+        self.pending = deque()
+        self.current = None
+        self.wakeup = None
+    
+    async def run(self):
+        """Handle requests one at a time in arrival order; runs on the engine loop"""
+        self.wakeup = asyncio.Event()
+        while True:
+            while not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            
+            request = self.pending.popleft()
+            if request["cancel"].is_cancelled():
+                continue
+            self.current = request
+            request["task"] = asyncio.ensure_future(self.handler(*request["args"], cancel=request["cancel"]))
+            try:
+                # wait() does not raise when the request task itself is cancelled
+                await asyncio.wait({request["task"]})
+            finally:
+                self.current = None
+    
+    def put(self, *args):
+        """Queue a request; with supersede on, older unfinished requests are cancelled. Engine loop only."""
+        if self.supersede:
+            self.cancel_all()
+        self.pending.append({"args": args, "cancel": CancelToken(), "task": None})
+        if self.wakeup:
+            self.wakeup.set()
+    
+    def cancel_all(self):
+        """Cancel queued requests and the one in flight, closing its HTTP stream. Engine loop only."""
+        for request in self.pending:
+            request["cancel"].cancel()
+        self.pending.clear()
+        
+        current = self.current
+        if current:
+            current["cancel"].cancel()
+            if current["task"]:
+                current["task"].cancel()
+    
+    def is_busy(self):
+        return bool(self.pending or self.current)
+
+class IntentClassifier:
+    """Settle confident query categories locally: keyword rules, then a hashed n-gram softmax model"""
+    PREFIX = r"^(?:(?:please|hey|ok|okay|can you|could you|would you|will you|kindly|now|also)[\s,]+)*"
+    TASK_VERBS = [
+        ("google search", re.compile(r"(?:search (?:on )?google for|search google|google search(?: for)?|google)\s+(?P<arg>.+)")),
+        ("youtube search", re.compile(r"(?:search (?:on )?youtube for|search youtube|youtube search(?: for)?)\s+(?P<arg>.+)")),
+        ("generate image", re.compile(r"(?:generate|create|make|draw)\s+(?:me\s+)?(?:an?\s+)?(?:image|picture|photo|drawing)s?\s+(?:of\s+|showing\s+|for\s+)?(?P<arg>.+)")),
+        ("reminder", re.compile(r"(?:remind me|set (?:a |an )?(?:reminder|alarm))\s+(?P<arg>.+)")),
+        ("content", re.compile(r"(?:write|compose|draft)\s+(?P<arg>(?:me\s+)?(?:an?\s+)?(?:email|mail|letter|essay|poem|application|story|article|note|song|blog|speech|code|program)\b.*)")),
+        ("open", re.compile(r"(?:open|launch)\s+(?P<arg>.+)")),
+        ("close", re.compile(r"(?:close|quit|kill)\s+(?P<arg>.+)")),
+        ("play", re.compile(r"play\s+(?P<arg>.+)")),
+    ]
+    SYSTEM_PATTERN = re.compile(r"(?P<arg>mute|unmute|volume up|volume down|increase (?:the )?volume|decrease (?:the )?volume|turn (?:up|down) the volume|turn the volume (?:up|down))")
+    # The whole message must be a farewell, optionally addressed to the assistant; "quit spotify" is a close command
+    EXIT_PATTERN = re.compile(
+        r"(?:bye|goodbye|good bye|exit|quit|see you(?: later)?|that'?s all|see ya)(?: for now)?(?:[\s,]+(?:"
+        + re.escape(Assistantname.lower()) + r"))?"
+    )
+    REALTIME_PATTERN = re.compile(r"\b(news|headlines|weather|forecast|stock price|share price|exchange rate|scores?|live score|latest|who won|trending)\b")
+    CLAUSE_SPLIT = re.compile(r"(\s*(?:,|;|\band then\b|\bthen\b|\band\b)\s*)")
+    # App and site names are short; longer arguments are probably not open/close commands
+    MAX_APP_WORDS = 4
+    
+    def __init__(self, model_path=INTENT_MODEL_PATH, log_path=INTENT_LOG_PATH):
+        self.model_path = model_path
+        self.log_path = log_path
+        self.lock = threading.Lock()
+        self.labels = list(QUERY_CATEGORIES)
+        self.weights = np.zeros((len(self.labels), INTENT_FEATURE_DIM), dtype=np.float32)
+        self.bias = np.zeros(len(self.labels), dtype=np.float32)
+        self.trained = 0
+        self.unsaved = 0
+        self.cache = OrderedDict()
+        self.counts = {"rules": 0, "model": 0, "cache": 0, "cohere": 0, "guess": 0}
+        self.local_us = deque(maxlen=ROUTER_LATENCY_WINDOW)
+        self.cohere_ms = deque(maxlen=ROUTER_LATENCY_WINDOW)
+        self.agreement = {"agree": 0, "total": 0}
+        self.load()
+    
+    def load(self):
+        """Load the saved model, or retrain it from the log of past Cohere decisions"""
+        if os.path.exists(self.model_path):
+            try:
+                with np.load(self.model_path) as data:
+                    if list(data["labels"]) == self.labels and data["weights"].shape == self.weights.shape:
+                        self.weights = data["weights"].astype(np.float32)
+                        self.bias = data["bias"].astype(np.float32)
+                        self.trained = int(data["trained"])
+                        return
+            except Exception as e:
+                print(f"Intent model load error: {e}")
+        
+        if os.path.exists(self.log_path):
+            with open(self.log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    label = self.label_of(record.get("categories") or [])
+                    if label:
+                        self.update(record["query"], label)
+            if self.trained:
+                self.save()
+    
+    def save(self):
+        """Write the model atomically"""
+        tmp_path = self.model_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, weights=self.weights, bias=self.bias, labels=np.array(self.labels), trained=self.trained)
+        os.replace(tmp_path, self.model_path)
+        self.unsaved = 0
+    
+    def label_of(self, categories):
+        """Top-level label of a category list, e.g. 'open' for ['open facebook', 'close whatsapp']"""
+        for func in self.labels:
+            if categories and categories[0].startswith(func):
+                return func
+        return None
+    
+    def vectorize(self, query):
+        hashes, weights = SemanticCache.features(query)
+        return (hashes % INTENT_FEATURE_DIM).astype(np.int64), weights
+    
+    def predict(self, query):
+        """Return (label, probability) from the n-gram model"""
+        index, values = self.vectorize(query)
+        scores = self.weights[:, index] @ values + self.bias
+        scores = np.exp(scores - scores.max())
+        probabilities = scores / scores.sum()
+        best = int(np.argmax(probabilities))
+        return self.labels[best], float(probabilities[best])
+    
+    def update(self, query, label):
+        """One SGD step of softmax regression towards the given label"""
+        index, values = self.vectorize(query)
+        scores = self.weights[:, index] @ values + self.bias
+        scores = np.exp(scores - scores.max())
+        gradient = scores / scores.sum()
+        gradient[self.labels.index(label)] -= 1.0
+        np.subtract.at(self.weights, (slice(None), index), INTENT_LEARNING_RATE * np.outer(gradient, values))
+        self.bias -= INTENT_LEARNING_RATE * gradient
+        self.trained += 1
+    
+    def match_rules(self, query):
+        """Parse explicit commands like 'open facebook, telegram and close whatsapp'"""
+        text = re.sub(self.PREFIX, "", query.lower().strip().rstrip(".!?"))
+        if self.EXIT_PATTERN.fullmatch(text):
+            return ["exit"]
+        if self.SYSTEM_PATTERN.fullmatch(text):
+            return [f"system {text}"]
+        
+        parts = self.CLAUSE_SPLIT.split(text)
+        tasks = []
+        for index in range(0, len(parts), 2):
+            clause = re.sub(self.PREFIX, "", parts[index])
+            separator = parts[index - 1] if index else ""
+            for func, pattern in self.TASK_VERBS:
+                match = pattern.fullmatch(clause)
+                if match:
+                    tasks.append([func, match.group("arg")])
+                    break
+            else:
+                system = self.SYSTEM_PATTERN.fullmatch(clause)
+                if system:
+                    tasks.append(["system", clause])
+                elif not tasks:
+                    return None
+                elif tasks[-1][0] in ("open", "close"):
+                    # "open facebook, telegram" -> the verb carries over
+                    tasks.append([tasks[-1][0], clause])
+                else:
+                    # "play rock and roll" -> the separator was part of the argument
+                    tasks[-1][1] += separator + clause
+        
+        for func, arg in tasks:
+            if not arg.strip() or (func in ("open", "close") and len(arg.split()) > self.MAX_APP_WORDS):
+                return None
+        return [f"{func} {arg.strip()}" for func, arg in tasks]
+    
+    def classify(self, query):
+        """Return (categories, source), or (None, None) when the query needs Cohere"""
+        started = time.perf_counter()
+        key = ResponseCache.normalize(query)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.counts["cache"] += 1
+                return list(self.cache[key]), "cache"
+        
+        categories, source = self.match_rules(query), "rules"
+        if categories is None:
+            if self.REALTIME_PATTERN.search(query.lower()):
+                categories = [f"realtime {query}"]
+            elif SMALL_TALK_PATTERN.match(query.strip()):
+                categories = [f"general {query}"]
+        if categories is None and self.trained >= INTENT_MIN_TRAINING:
+            with self.lock:
+                label, probability = self.predict(query)
+            # The model only decides query-level labels; task arguments need the rules or Cohere
+            if probability >= INTENT_CONFIDENCE and label in ("general", "realtime"):
+                categories, source = [f"{label} {query}"], "model"
+        
+        if categories is None:
+            return None, None
+        with self.lock:
+            self.counts[source] += 1
+            self.local_us.append((time.perf_counter() - started) * 1e6)
+            self.remember(key, categories)
+        return categories, source
+    
+    def best_guess(self, query):
+        """Fallback when Cohere is unavailable"""
+        with self.lock:
+            self.counts["guess"] += 1
+            if self.trained >= INTENT_MIN_TRAINING:
+                label, _ = self.predict(query)
+                if label in ("general", "realtime"):
+                    return [f"{label} {query}"]
+        return ["general"]
+    
+    def remember(self, key, categories):
+        self.cache[key] = list(categories)
+        if len(self.cache) > INTENT_CACHE_SIZE:
+            self.cache.popitem(last=False)
+    
+    def learn(self, query, categories, cohere_ms):
+        """Train on a Cohere decision and log it for future retraining"""
+        label = self.label_of(categories)
+        with self.lock:
+            self.counts["cohere"] += 1
+            self.cohere_ms.append(cohere_ms)
+            self.remember(ResponseCache.normalize(query), categories)
+            if label is None:
+                return
+            
+            # Track how often the local model would already have agreed
+            if self.trained:
+                self.agreement["total"] += 1
+                self.agreement["agree"] += self.predict(query)[0] == label
+            self.update(query, label)
+            self.unsaved += 1
+            if self.unsaved >= INTENT_SAVE_EVERY:
+                self.save()
+        
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"query": query, "categories": categories, "ts": time.time()}, ensure_ascii=False) + "\n")
+    
+    def record_shadow(self, local_categories, cohere_categories):
+        """Compare a confident local decision with Cohere's answer for the same query"""
+        with self.lock:
+            self.agreement["total"] += 1
+            self.agreement["agree"] += self.label_of(local_categories) == self.label_of(cohere_categories)
+    
+    def stats(self):
+        """Decision counts, latency percentiles and agreement with Cohere"""
+        with self.lock:
+            total = self.agreement["total"]
+            return {
+                "decisions": dict(self.counts),
+                "local_p50_us": percentile(self.local_us, 50),
+                "cohere_p50_ms": percentile(self.cohere_ms, 50),
+                "agreement": self.agreement["agree"] / total if total else None,
+                "compared": total,
+                "trained": self.trained
+            }
+    
+    def close(self):
+        with self.lock:
+            if self.unsaved:
+                self.save()
+
+class ReminderScheduler:
+    """Persistent reminders on a min-heap, fired by one thread that sleeps until the next one is due"""
+    def __init__(self, path, on_fire):
+        self.on_fire = on_fire
+        self.condition = threading.Condition()
+        self.heap = []
+        self.reminders = {}
+        self.stopped = False
+        self.thread = None
+        
+        # Replay the journal: 'reminder' records add, 'fired'/'cancelled' records remove
+        self.journal = ConversationJournal(path)
+        records = self.journal.load()
+        closed = 0
+        for record in records:
+            if record.get("role") == "reminder":
+                self.reminders[record["id"]] = record
+            elif self.reminders.pop(record.get("target"), None):
+                closed += 1
+        self.heap = [(r["due"], r["id"]) for r in self.reminders.values()]
+        heapq.heapify(self.heap)
+        
+        # Rewrite the journal once finished reminders dominate it
+        if closed > len(self.reminders):
+            self.journal.compact(sorted(self.reminders.values(), key=lambda r: r["seq"]))
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="ReminderScheduler", daemon=True)
+        self.thread.start()
+        return self
+    
+    def add(self, due, message):
+        """Schedule a reminder at a unix timestamp; O(log n)"""
+        with self.condition:
+            record = self.journal.append("reminder", message, id=uuid.uuid4().hex, due=due)
+            self.reminders[record["id"]] = record
+            heapq.heappush(self.heap, (due, record["id"]))
+            # Only wake the thread when the new reminder is the next one due
+            if self.heap[0][1] == record["id"]:
+                self.condition.notify()
+        return record
+    
+    def cancel(self, reminder_id):
+        """Cancel a pending reminder; its heap entry is skipped lazily"""
+        with self.condition:
+            if self.reminders.pop(reminder_id, None):
+                self.journal.append("cancelled", "", target=reminder_id)
+                return True
+        return False
+    
+    def pending(self):
+        """Pending reminders in due order"""
+        with self.condition:
+            return sorted(self.reminders.values(), key=lambda r: r["due"])
+    
+    def run(self):
+        """Sleep until the earliest reminder is due, then fire everything that is due"""
+        # Reminders missed while the app was closed are announced first
+        missed = self.pop_due()
+        if missed:
+            self.fire(missed, missed=True)
+        
+        while True:
+            with self.condition:
+                while not self.stopped:
+                    # Drop heap entries of cancelled reminders
+                    while self.heap and self.heap[0][1] not in self.reminders:
+                        heapq.heappop(self.heap)
+                    timeout = self.heap[0][0] - time.time() if self.heap else None
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self.condition.wait(timeout)
+                if self.stopped:
+                    return
+            self.fire(self.pop_due())
+    
+    def pop_due(self):
+        """Remove and return every reminder that is due"""
+        due = []
+        now = time.time()
+        with self.condition:
+            while self.heap and self.heap[0][0] <= now:
+                _, reminder_id = heapq.heappop(self.heap)
+                reminder = self.reminders.pop(reminder_id, None)
+                if reminder:
+                    due.append(reminder)
+        return due
+    
+    def fire(self, reminders, missed=False):
+        """Announce reminders and only then mark them fired"""
+        try:
+            self.on_fire(reminders, missed)
+        except Exception as e:
+            print(f"Reminder error: {e}")
+            # Not journaled as fired, so they are retried here and caught up after a restart
+            retry = time.time() + REMINDER_RETRY_SECONDS
+            with self.condition:
+                for reminder in reminders:
+                    self.reminders[reminder["id"]] = reminder
+                    heapq.heappush(self.heap, (retry, reminder["id"]))
+            return
+        with self.condition:
+            for reminder in reminders:
+                self.journal.append("fired", "", target=reminder["id"])
+    
+    @staticmethod
+    def parse(text, now=None):
+        """Parse 'at 5pm to call mom', 'tomorrow at 9 standup' or 'in 10 minutes to stretch' into (due, message)"""
+        now = now or datetime.datetime.now()
+        match = re.search(r"\bin (\d+) (second|minute|hour|day)s?\b", text)
+        if match:
+            due = now + datetime.timedelta(**{match.group(2) + "s": int(match.group(1))})
+            spans = [match.span()]
+        else:
+            match = re.search(r"\bat (\d{1,2})(?::(\d{2}))? ?(am|pm|a\.m\.|p\.m\.)?(?!\w)", text)
+            if not match:
+                raise RuntimeError("could not find a time")
+            hour, minute = int(match.group(1)), int(match.group(2) or 0)
+            if match.group(3):
+                hour = hour % 12 + (12 if match.group(3).startswith("p") else 0)
+            due = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            spans = [match.span()]
+            
+            day = re.search(r"\b(today|tomorrow)\b", text)
+            if day:
+                spans.append(day.span())
+                if day.group(1) == "tomorrow":
+                    due += datetime.timedelta(days=1)
+            if due <= now:
+                due += datetime.timedelta(days=1)
+        
+        for start, end in sorted(spans, reverse=True):
+            text = text[:start] + text[end:]
+        message = re.sub(r"^\s*(to|that|about)\s+", "", " ".join(text.split())) or "reminder"
+        return due, message
+    
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.thread:
+            self.thread.join(timeout=2)
+        self.journal.close()
+
+class TaskDispatcher:
+    """Run categorized tasks like 'open chrome' concurrently with per-task timeouts and live status"""
+    def __init__(self, app):
+        self.app = app
+        # .desktop ids found by find_launcher -> their files
+        self.launcher_paths = {}
+        self.handlers = {
+            "open": self.open_app,
+            "close": self.close_app,
+            "play": self.play,
+            "system": self.system,
+            "reminder": self.reminder,
+            "content": self.content,
+            "google search": self.google_search,
+            "youtube search": self.youtube_search,
+            "generate image": self.generate_image,
+            "exit": self.exit
+        }
+        self.timeouts = {"content": CONTENT_TASK_TIMEOUT}
+        # Longest prefix first so 'google search x' is not read as a shorter command
+        self.prefixes = sorted(self.handlers, key=len, reverse=True)
+    
+    def parse(self, task):
+        """Split 'google search cats' into ('google search', 'cats')"""
+        for prefix in self.prefixes:
+            if task == prefix or task.startswith(prefix + " "):
+                return prefix, task[len(prefix):].strip()
+        return None, task
+    
+    async def run(self, tasks):
+        """Run all tasks, updating one status bubble as each finishes; returns the final status text"""
+        jobs = []
+        for task in tasks:
+            kind, arg = self.parse(task)
+            jobs.append({"task": task, "kind": kind, "arg": arg, "status": "…"})
+        status = {"label": None}
+        
+        def render():
+            return "\n".join(f"{job['status']} {job['task']}" + (f" - {job['result']}" if job.get("result") else "") for job in jobs)
+        
+        def show(text):
+            _, status["label"] = self.app.add_message(text, "assistant")
+        
+        def update(text):
+            self.app.update_message(status["label"], text)
+        
+        self.app.ui.post(show, render())
+        
+        # Tasks on the same target ('open chrome', 'close chrome') keep their order; others run concurrently
+        groups = {}
+        for job in jobs:
+            groups.setdefault(job["arg"].lower(), []).append(job)
+        
+        async def run_group(group):
+            for job in group:
+                job["status"], job["result"] = await self.run_job(job)
+                self.app.ui.post(update, render())
+        
+        await asyncio.gather(*(run_group(group) for group in groups.values()))
+        return render()
+    
+    async def run_job(self, job):
+        """Run one task on the bounded task pool; returns (status mark, result text)"""
+        handler = self.handlers.get(job["kind"])
+        if handler is None:
+            return "✖", "unknown task"
+        timeout = self.timeouts.get(job["kind"], TASK_TIMEOUT)
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(self.app.engine.run_blocking("tasks", handler, job["arg"]), timeout)
+            print(f"Task '{job['task']}' done in {(time.perf_counter() - started) * 1000:.0f} ms")
+            return "✔", result
+        except asyncio.TimeoutError:
+            print(f"Task '{job['task']}' timed out after {timeout:g}s")
+            return "✖", "timed out"
+        except Exception as e:
+            print(f"Task '{job['task']}' error: {e}")
+            return "✖", str(e)
+    
+    @staticmethod
+    def open_path(target):
+        """Open a file or URL with the platform's default handler"""
+        if sys.platform == "win32":
+            os.startfile(target)
+        elif sys.platform == "darwin":
+            subprocess.Popen(["open", target])
+        else:
+            subprocess.Popen(["xdg-open", target], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    
+    def open_app(self, name):
+        """Launch an installed app, falling back to its website"""
+        if re.fullmatch(r"[\w.-]+\.[a-z]{2,}(/\S*)?", name):
+            webbrowser.open(name if "://" in name else f"https://{name}")
+            return "opened website"
+        try:
+            if sys.platform == "darwin":
+                # 'open -a' only resolves application bundles
+                if subprocess.run(["open", "-a", name], capture_output=True).returncode == 0:
+                    return "launched"
+            else:
+                launcher = self.find_launcher(name)
+                if launcher and sys.platform == "win32":
+                    os.startfile(launcher)
+                    return "launched"
+                if launcher:
+                    command = ["gtk-launch", launcher] if shutil.which("gtk-launch") else ["gio", "launch", self.launcher_paths[launcher]]
+                    subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+                    return "launched"
+        except OSError:
+            pass
+        webbrowser.open(f"https://www.google.com/search?q={urllib.parse.quote_plus(name)}&btnI=1")
+        return "not installed, opened website"
+    
+    def find_launcher(self, name):
+        """Return the menu entry for an app: a .desktop id on Linux, a Start Menu shortcut on Windows, or None"""
+        wanted = name.lower().replace(" ", "")
+        directories = APP_LAUNCHER_DIRS.get("win32" if sys.platform == "win32" else "linux", [])
+        for directory in directories:
+            directory = os.path.expanduser(directory)
+            if not os.path.isdir(directory):
+                continue
+            for root, _, files in os.walk(directory):
+                for filename in files:
+                    stem, extension = os.path.splitext(filename)
+                    if sys.platform == "win32":
+                        if extension.lower() == ".lnk" and stem.lower().replace(" ", "") == wanted:
+                            return os.path.join(root, filename)
+                        continue
+                    if extension != ".desktop":
+                        continue
+                    # Match the file id, its last part ('org.gnome.Calculator') or the display name
+                    names = {stem.lower(), stem.rsplit(".", 1)[-1].lower()}
+                    try:
+                        with open(os.path.join(root, filename), "r", encoding="utf-8", errors="ignore") as f:
+                            display = re.search(r"^Name=(.+)$", f.read(), re.MULTILINE)
+                    except OSError:
+                        continue
+                    if display:
+                        names.add(display.group(1).strip().lower())
+                    if wanted in {n.replace(" ", "") for n in names}:
+                        self.launcher_paths[stem] = os.path.join(root, filename)
+                        return stem
+        return None
+    
+    def close_app(self, name):
+        """Close a running app by its exact process name"""
+        own = os.path.splitext(os.path.basename(sys.executable))[0].lower()
+        if name.lower().replace(" ", "") in (own, os.path.splitext(os.path.basename(sys.argv[0]))[0].lower()):
+            raise RuntimeError("refusing to close the assistant itself")
+        if sys.platform == "win32":
+            image = name if name.lower().endswith(".exe") else name.replace(" ", "") + ".exe"
+            result = subprocess.run(["taskkill", "/im", image, "/f"], capture_output=True)
+        else:
+            result = subprocess.run(["pkill", "-i", "-x", name.replace(" ", "")], capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError("not running")
+        return "closed"
+    
+    def play(self, query):
+        webbrowser.open(f"https://www.youtube.com/results?search_query={urllib.parse.quote_plus(query)}")
+        return "opened on YouTube"
+    
+    def google_search(self, query):
+        webbrowser.open(f"https://www.google.com/search?q={urllib.parse.quote_plus(query)}")
+        return "searched"
+    
+    def youtube_search(self, query):
+        webbrowser.open(f"https://www.youtube.com/results?search_query={urllib.parse.quote_plus(query)}")
+        return "searched"
+    
+    def generate_image(self, prompt):
+        webbrowser.open(IMAGE_GENERATION_URL.format(prompt=urllib.parse.quote(prompt)))
+        return "opened image generator"
+    
+    def system(self, command):
+        """Change the volume with the platform's own tools"""
+        if "unmute" in command:
+            action = "unmute"
+        elif "mute" in command:
+            action = "mute"
+        elif any(word in command for word in ("down", "decrease", "lower")):
+            action = "down"
+        elif any(word in command for word in ("up", "increase", "raise")):
+            action = "up"
+        else:
+            raise RuntimeError(f"unsupported system command '{command}'")
+        
+        if sys.platform == "win32":
+            import ctypes
+            # Media keys: mute toggles, up/down move the volume by one step per press
+            key, presses = {"mute": (0xAD, 1), "unmute": (0xAD, 1), "down": (0xAE, 5), "up": (0xAF, 5)}[action]
+            for _ in range(presses):
+                ctypes.windll.user32.keybd_event(key, 0, 0, 0)
+                ctypes.windll.user32.keybd_event(key, 0, 2, 0)
+        elif sys.platform == "darwin":
+            script = {
+                "mute": "set volume with output muted",
+                "unmute": "set volume without output muted",
+                "down": "set volume output volume (output volume of (get volume settings) - 10)",
+                "up": "set volume output volume (output volume of (get volume settings) + 10)"
+            }[action]
+            subprocess.run(["osascript", "-e", script], check=True, capture_output=True)
+        else:
+            setting = {"mute": "mute", "unmute": "unmute", "down": "10%-", "up": "10%+"}[action]
+            subprocess.run(["amixer", "-q", "set", "Master", setting], check=True, capture_output=True)
+        return action
+    
+    def reminder(self, text):
+        """Schedule a persistent reminder like 'at 5pm to call mom' or 'in 10 minutes to stretch'"""
+        due, message = ReminderScheduler.parse(text)
+        self.app.reminders.add(due.timestamp(), message)
+        return f"'{message}' set for {due.strftime('%a %H:%M')}"
+    
+    def content(self, topic):
+        """Write the requested text with the LLM, save it under Data/Content and open it"""
+        if not llm:
+            raise RuntimeError("no LLM provider configured")
+        messages = [{"role": "system", "content": "You are a writing assistant. Write the requested content in full, without commentary."}]
+        passages = self.app.knowledge.search(topic)
+        if passages:
+            messages.append(KnowledgeBase.format_passages(passages))
+        messages.append({"role": "user", "content": topic})
+        text = llm.complete(LLM_MODEL, messages, max_tokens=QUALITY_MAX_TOKENS, temperature=0.7)
+        
+        os.makedirs(CONTENT_DIR, exist_ok=True)
+        slug = re.sub(r"[^\w]+", "_", topic.lower()).strip("_")[:60] or "content"
+        path = os.path.join(CONTENT_DIR, f"{slug}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text.replace(END_OF_SEQUENCE, "").strip() + "\n")
+        self.open_path(os.path.abspath(path))
+        return f"saved to {path}"
+    
+    def exit(self, _):
+        """Say goodbye and close the window"""
+        self.app.ui.post(self.app.root.after, 1500, self.app.root.event_generate, "<<AppExit>>")
+        return "goodbye"
+
+class UtteranceDetector:
+    """Decide when the user has finished speaking from the partial and final results seen so far"""
+    def __init__(self, silence_ms=VOICE_SILENCE_MS, max_seconds=VOICE_MAX_UTTERANCE_SECONDS,
+                 final_ends=VOICE_FINAL_ENDS_UTTERANCE):
+        self.silence = silence_ms / 1000
+        self.max_seconds = max_seconds
+        self.final_ends = final_ends
+        self.reset()
+    
+    def reset(self):
+        self.finals = []
+        self.partial = ""
+        self.started = None
+        self.last_speech = None
+    
+    def text(self):
+        return " ".join(self.finals + ([self.partial] if self.partial else [])).strip()
+    
+    def feed(self, result):
+        """Add a result (None for an idle tick); return the end reason once the utterance is over"""
+        now = time.perf_counter()
+        if result is not None:
+            if self.started is None:
+                self.started = result["ts"]
+            self.last_speech = result["ts"]
+            if result["final"]:
+                self.finals.append(result["text"])
+                self.partial = ""
+                if self.final_ends:
+                    return "final"
+            else:
+                self.partial = result["text"]
+        
+        if self.started is None:
+            return None
+        if now - self.last_speech >= self.silence:
+            return "silence"
+        if now - self.started >= self.max_seconds:
+            return "max_length"
+        return None
+    
+    def tick(self):
+        """How long to wait for the next result before re-checking the silence timer"""
+        return min(0.1, self.silence / 2)
+
+class SpeechRecognizer:
+    """Speech backend interface: start() begins capture, results() streams transcripts, stop() ends capture"""
+    name = "base"
+    
+    def __init__(self):
+        self.session = None
+        self.error = None
+        # A new capture waits until the previous one has wound down
+        self.capture_lock = threading.Lock()
+    
+    def capture(self, emit, should_continue):
+        """Blocking producer run on a worker thread; calls emit(text, final) until should_continue() is false"""
+        raise NotImplementedError
+    
+    async def start(self):
+        """Begin capturing on a worker thread; results are queued for results()"""
+        session = {"active": threading.Event(), "queue": asyncio.Queue(), "loop": asyncio.get_running_loop()}
+        session["active"].set()
+        self.session = session
+        threading.Thread(target=self.run_capture, args=(session,), name=f"{self.name}-recognizer", daemon=True).start()
+    
+    def run_capture(self, session):
+        error = None
+        try:
+            with self.capture_lock:
+                if session["active"].is_set():
+                    self.capture(lambda text, final: self.emit(session, text, final), session["active"].is_set)
+        except Exception as e:
+            error = e
+        # None ends the stream; an exception is re-raised by results()
+        session["loop"].call_soon_threadsafe(session["queue"].put_nowait, error)
+    
+    def emit(self, session, text, final):
+        """Queue a transcript from the capture thread"""
+        if text and session["active"].is_set():
+            result = {"text": text, "final": final, "ts": time.perf_counter()}
+            session["loop"].call_soon_threadsafe(session["queue"].put_nowait, result)
+    
+    async def results(self, tick=None):
+        """Yield {'text', 'final', 'ts'} dicts until capture ends; with a tick, yield None after that many idle seconds"""
+        session = self.session
+        while True:
+            try:
+                result = await asyncio.wait_for(session["queue"].get(), tick)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            if result is None:
+                return
+            if isinstance(result, Exception):
+                raise result
+            yield result
+    
+    def stop(self):
+        """Stop capturing; safe from any thread"""
+        if self.session:
+            self.session["active"].clear()
+    
+    def is_alive(self):
+        return True
+    
+    def warm_up(self):
+        """Prepare for listening ahead of time"""
+    
+    def release(self):
+        """Voice mode was left"""
+    
+    def close(self):
+        self.stop()
+
+def mp3_frame_info(buffer, pos):
+    """Return (length, sample_rate, samples) of the Layer III frame at pos, None if more data is needed, 0 if no frame starts there"""
+    if pos + 4 > len(buffer):
+        return None
+    b1, b2 = buffer[pos + 1], buffer[pos + 2]
+    version, layer = (b1 >> 3) & 3, (b1 >> 1) & 3
+    bitrate_index, rate_index = b2 >> 4, (b2 >> 2) & 3
+    if buffer[pos] != 0xFF or b1 & 0xE0 != 0xE0 or version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return 0
+    bitrate = MP3_BITRATES["1" if version == 3 else "2"][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+    samples = 1152 if version == 3 else 576
+    length = samples // 8 * bitrate // sample_rate + ((b2 >> 1) & 1)
+    return length, sample_rate, samples
+
+class Mp3Segmenter:
+    """Cut a streamed MP3 into frame-aligned segments that can be decoded and played one after another"""
+    def __init__(self, first_bytes=TTS_FIRST_SEGMENT_BYTES, segment_bytes=TTS_SEGMENT_BYTES):
+        self.segment_bytes = segment_bytes
+        self.target = first_bytes
+        self.buffer = bytearray()
+        self.frames = []
+        self.scan = 0
+        # Leading frames already played by the previous segment, kept only to prime the decoder
+        self.overlap = 0
+        self.format = None
+    
+    def feed(self, data):
+        """Add streamed bytes; return any segments that are ready"""
+        self.buffer += data
+        segments = []
+        while True:
+            info = mp3_frame_info(self.buffer, self.scan)
+            if info is None:
+                break
+            if info == 0:
+                # Not a frame header: resynchronize one byte further on
+                self.scan += 1
+                continue
+            length, sample_rate, samples = info
+            if self.scan + length > len(self.buffer):
+                break
+            self.frames.append(self.scan)
+            self.scan += length
+            self.format = (sample_rate, samples)
+            if self.scan - self.frames[self.overlap] >= self.target:
+                segments.append(self.cut())
+        return segments
+    
+    def cut(self):
+        """Return (mp3 bytes, overlap frames, sample rate, samples per frame) and keep the tail as the next overlap"""
+        segment = (bytes(self.buffer[:self.scan]), self.overlap) + self.format
+        keep = self.frames[-MP3_OVERLAP_FRAMES:]
+        start = keep[0]
+        del self.buffer[:start]
+        self.scan -= start
+        self.frames = [frame - start for frame in keep]
+        self.overlap = len(keep)
+        self.target = self.segment_bytes
+        return segment
+    
+    def flush(self):
+        """Return the last segment once the stream has ended, or None"""
+        if len(self.frames) > self.overlap:
+            return self.cut()
+        return None
+
+def decode_segment(segment):
+    """Decode an MP3 segment into a mixer Sound, dropping the audio of its overlap frames"""
+    data, overlap, sample_rate, samples = segment
+    sound = pygame.mixer.Sound(file=io.BytesIO(data))
+    if overlap:
+        frequency, size, channels = pygame.mixer.get_init()
+        skip = round(overlap * samples * frequency / sample_rate) * channels * (abs(size) // 8)
+        sound = pygame.mixer.Sound(buffer=sound.get_raw()[skip:])
+    return sound
+
+class SegmentPlayer:
+    """Play decoded segments back to back on a reserved mixer channel"""
+    def __init__(self):
+        self.channel = pygame.mixer.Channel(0)
+        self.pending = deque()
+    
+    def add(self, sound):
+        self.pending.append(sound)
+        self.pump()
+    
+    def pump(self):
+        """Start the next segment, and queue the one after it so the seam is gapless"""
+        if self.pending and not self.channel.get_busy():
+            self.channel.play(self.pending.popleft())
+        if self.pending and self.channel.get_queue() is None:
+            self.channel.queue(self.pending.popleft())
+    
+    def busy(self):
+        return bool(self.pending) or self.channel.get_busy()
+    
+    def stop(self):
+        self.pending.clear()
+        self.channel.stop()
+
+class Utterance:
+    """MP3 segments of one spoken response, handed in speaking order to the audio worker"""
+    def __init__(self, priority=SPEECH_PRIORITY_ANSWER):
+        self.priority = priority
+        self.segments = queue.Queue()
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+        self.created = time.perf_counter()
+    
+    def add(self, segment):
+        self.segments.put(segment)
+    
+    def end(self):
+        self.segments.put(None)
+    
+    def cancel(self):
+        self.cancelled.set()
+        self.segments.put(None)
+
+class AudioWorker:
+    """Thread that owns the mixer and plays queued utterances one at a time, by priority"""
+    def __init__(self, on_state=None):
+        # Called from the worker thread with "speaking", "finished" or "interrupted"
+        self.on_state = on_state
+        self.queue = queue.PriorityQueue()
+        self.lock = threading.Lock()
+        self.sequence = 0
+        # Utterances queued up to this sequence number were interrupted
+        self.cutoff = 0
+        self.current = None
+        self.error = None
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+    
+    def start(self):
+        """Start the thread and wait for the mixer to come up"""
+        self.thread.start()
+        self.ready.wait(timeout=5)
+        return self
+    
+    def put(self, priority, utterance):
+        with self.lock:
+            self.sequence += 1
+            self.queue.put((priority, self.sequence, utterance))
+    
+    def speak(self, utterance):
+        """Queue an utterance from any thread"""
+        if self.error:
+            utterance.cancel()
+            utterance.done.set()
+            return
+        self.put(utterance.priority, utterance)
+    
+    def interrupt(self):
+        """Stop the utterance being played and drop everything queued; safe from any thread"""
+        with self.lock:
+            self.cutoff = self.sequence
+            if self.current:
+                self.current.cancel()
+    
+    def run(self):
+        try:
+            pygame.mixer.init(frequency=TTS_SAMPLE_RATE, channels=1)
+            # Channel 0 is kept for speech playback
+            pygame.mixer.set_reserved(1)
+        except Exception as e:
+            self.error = e
+            print(f"Audio error: {e}")
+            return
+        finally:
+            self.ready.set()
+        
+        while True:
+            _, sequence, utterance = self.queue.get()
+            if utterance is None:
+                break
+            with self.lock:
+                if sequence <= self.cutoff:
+                    utterance.cancel()
+                self.current = utterance
+            try:
+                if not utterance.cancelled.is_set():
+                    self.play(utterance)
+            except Exception as e:
+                print(f"Audio error: {e}")
+            finally:
+                with self.lock:
+                    self.current = None
+                utterance.done.set()
+        pygame.mixer.quit()
+    
+    def play(self, utterance):
+        """Decode and play segments as they arrive until the utterance ends or is cancelled"""
+        player = SegmentPlayer()
+        first_audio = None
+        try:
+            while not utterance.cancelled.is_set():
+                try:
+                    segment = utterance.segments.get(timeout=0.02)
+                except queue.Empty:
+                    # Segments must be handed to the channel even while synthesis stalls
+                    player.pump()
+                    continue
+                if segment is None:
+                    break
+                player.add(decode_segment(segment))
+                if first_audio is None:
+                    first_audio = time.perf_counter()
+                    print(f"TTS first audio after {(first_audio - utterance.created) * 1000:.0f} ms")
+                    self.notify("speaking")
+            
+            while player.busy() and not utterance.cancelled.is_set():
+                player.pump()
+                time.sleep(0.02)
+        finally:
+            player.stop()
+            if first_audio is not None:
+                self.notify("interrupted" if utterance.cancelled.is_set() else "finished")
+    
+    def notify(self, state):
+        if self.on_state:
+            self.on_state(state)
+    
+    def stop(self):
+        """Interrupt playback, then shut the thread and the mixer down"""
+        self.interrupt()
+        self.put(-1, None)
+        self.thread.join(timeout=2)
+
+async def synthesize_speech(text):
+    """Yield MP3 bytes for text as edge-tts streams them"""
+    communicate = edge_tts.Communicate(text, AssistantVoice, pitch=TTS_PITCH, rate=TTS_RATE)
+    async for chunk in communicate.stream():
+        if chunk["type"] == "audio":
+            yield chunk["data"]
+
+class SpeechPipeline:
+    """Turn text into an utterance as it arrives, synthesizing later sentences while earlier ones play"""
+    SENTENCE_END = re.compile(r'[.!?…]+["\')\]]*\s+|\n+')
+    CLAUSE_END = re.compile(r'[,;:—–]\s+')
+    MARKUP = re.compile(r'[*_#`>|]+')
+    
+    def __init__(self, loop, synthesize=synthesize_speech, priority=SPEECH_PRIORITY_ANSWER, concurrency=TTS_SYNTH_CONCURRENCY):
+        self.loop = loop
+        self.synthesize = synthesize
+        self.limit = asyncio.Semaphore(concurrency)
+        self.utterance = Utterance(priority)
+        self.buffer = ""
+        # One queue of MP3 segments per chunk, in speaking order; None ends the text
+        self.chunks = asyncio.Queue()
+        self.pending = []
+        self.tasks = []
+        self.cancelled = False
+        self.finished = False
+    
+    def feed(self, text):
+        """Add text from any thread"""
+        self.loop.call_soon_threadsafe(self.add_text, text)
+    
+    def finish(self):
+        """Mark the text as complete from any thread"""
+        self.loop.call_soon_threadsafe(self.end)
+    
+    def add_text(self, text):
+        if self.cancelled or self.finished:
+            return
+        chunks, self.buffer = self.cut(self.buffer + text, first=not self.tasks)
+        for chunk in chunks:
+            self.start_chunk(chunk)
+    
+    def end(self):
+        if self.cancelled or self.finished:
+            return
+        self.finished = True
+        self.start_chunk(self.buffer)
+        self.buffer = ""
+        self.chunks.put_nowait(None)
+    
+    @classmethod
+    def cut(cls, text, first=True):
+        """Return (chunks, rest): complete sentences, and over-long pieces of an unfinished one, cut off text"""
+        chunks = []
+        while text:
+            # The first chunk is kept short so speech starts early
+            limit = TTS_FIRST_CHUNK_CHARS if first and not chunks else TTS_MAX_CHUNK_CHARS
+            match = cls.SENTENCE_END.search(text)
+            if match and match.end() <= limit:
+                end = match.end()
+            elif len(text) > limit:
+                end = cls.break_point(text[:limit + 1])
+            elif match:
+                # A complete sentence just over the limit that has no better break
+                end = match.end()
+            else:
+                break
+            chunks.append(text[:end])
+            text = text[end:]
+        return chunks, text
+    
+    @classmethod
+    def split(cls, text):
+        """Return the cleaned chunks a complete text is spoken in"""
+        chunks, rest = cls.cut(text)
+        return [chunk for chunk in map(cls.clean, chunks + [rest]) if chunk]
+    
+    @classmethod
+    def clean(cls, text):
+        """Drop markdown symbols; return an empty string if nothing is left to say"""
+        text = cls.MARKUP.sub("", text).strip()
+        return text if any(ch.isalnum() for ch in text) else ""
+    
+    @classmethod
+    def break_point(cls, text):
+        """Return where to cut text that is too long: the last clause break, else the last space"""
+        clauses = [m.end() for m in cls.CLAUSE_END.finditer(text) if m.end() >= len(text) // 3]
+        if clauses:
+            return clauses[-1]
+        space = text.rfind(" ")
+        return space + 1 if space > 0 else len(text)
+    
+    def start_chunk(self, text):
+        text = self.clean(text)
+        if not text:
+            return
+        segments = asyncio.Queue()
+        self.chunks.put_nowait(segments)
+        self.pending.append(segments)
+        self.tasks.append(self.loop.create_task(self.synthesize_chunk(text, segments)))
+    
+    async def synthesize_chunk(self, text, segments):
+        """Synthesize one chunk once a slot is free, queueing its segments as they complete"""
+        try:
+            async with self.limit:
+                segmenter = Mp3Segmenter()
+                async for data in self.synthesize(text):
+                    for segment in segmenter.feed(data):
+                        segments.put_nowait(segment)
+                segment = segmenter.flush()
+                if segment:
+                    segments.put_nowait(segment)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"TTS error: {e}")
+        finally:
+            segments.put_nowait(None)
+    
+    async def run(self):
+        """Hand every chunk's segments to the utterance in order until the text is finished or cancelled"""
+        try:
+            while not self.cancelled:
+                segments = await self.chunks.get()
+                if segments is None:
+                    break
+                while not self.cancelled:
+                    segment = await segments.get()
+                    if segment is None:
+                        break
+                    self.utterance.add(segment)
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+        finally:
+            self.utterance.end()
+    
+    def cancel(self):
+        """Stop synthesis and playback; runs on the engine loop"""
+        if self.cancelled:
+            return
+        self.cancelled = True
+        self.utterance.cancel()
+        for task in self.tasks:
+            task.cancel()
+        # Wake run() waiting for the next chunk, or for a chunk whose task never ran
+        self.chunks.put_nowait(None)
+        for segments in self.pending:
+            segments.put_nowait(None)
+
+class TTSCache:
+    """Size-bounded on-disk LRU cache of synthesized speech, keyed by text and voice settings"""
+    def __init__(self, directory=TTS_CACHE_DIR, max_bytes=int(TTS_CACHE_MAX_MB * 1024 * 1024), source=synthesize_speech):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.source = source
+        self.lock = threading.Lock()
+        # key -> file size, least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+    
+    def load(self):
+        """Index cached files; their modification times carry the LRU order across restarts"""
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".tmp"):
+                # Left behind by a write that never finished
+                os.remove(entry.path)
+            elif entry.name.endswith(".mp3"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.size += size
+        self.evict()
+    
+    @staticmethod
+    def make_key(text):
+        """Hash the text together with the voice, pitch and rate it is spoken with"""
+        payload = json.dumps({"text": text, "voice": AssistantVoice, "pitch": TTS_PITCH, "rate": TTS_RATE}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def path(self, key):
+        return os.path.join(self.directory, key + ".mp3")
+    
+    def __contains__(self, text):
+        with self.lock:
+            return self.make_key(text) in self.entries
+    
+    def get(self, key):
+        """Return cached MP3 bytes and mark them as recently used, or None"""
+        with self.lock:
+            if key in self.entries:
+                try:
+                    with open(self.path(key), "rb") as f:
+                        data = f.read()
+                    os.utime(self.path(key))
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return data
+                except OSError:
+                    # The file was removed behind our back
+                    self.size -= self.entries.pop(key)
+            self.misses += 1
+            return None
+    
+    def put(self, key, data):
+        """Store MP3 bytes atomically and evict the least recently used files beyond the size bound"""
+        path = self.path(key)
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"TTS cache error: {e}")
+            return
+        with self.lock:
+            self.size -= self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            self.size += len(data)
+            self.evict()
+    
+    def evict(self):
+        while self.size > self.max_bytes and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+    
+    async def synthesize(self, text):
+        """Yield MP3 bytes for text: from disk on a hit, else from the source while caching the result"""
+        key = self.make_key(text)
+        data = self.get(key)
+        if data is not None:
+            yield data
+            return
+        parts = []
+        async for data in self.source(text):
+            parts.append(data)
+            yield data
+        # Only complete syntheses are stored; a cancelled one never gets here
+        if parts:
+            self.put(key, b"".join(parts))
+    
+    async def warm_up(self, phrases, is_idle):
+        """Synthesize the chunks of phrases that are not cached yet, one at a time while is_idle() holds"""
+        count = 0
+        for phrase in phrases:
+            for text in SpeechPipeline.split(phrase):
+                if text in self:
+                    continue
+                while not is_idle():
+                    await asyncio.sleep(TTS_WARM_UP_IDLE_SECONDS)
+                async for _ in self.synthesize(text):
+                    pass
+                count += 1
+        return count
+    
+    def stats(self):
+        """Return hit/miss counters and the current size"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+                "bytes": self.size
+            }
+
+class ChromeRecognizer(SpeechRecognizer):
+    """Headless Chrome running webkitSpeechRecognition, started on first use and supervised"""
+    name = "chrome"
+    
+    def __init__(self, language=InputLanguage, idle_timeout=VOICE_IDLE_SHUTDOWN):
+        super().__init__()
+        self.language = language
+        self.idle_timeout = idle_timeout
+        self.lock = threading.RLock()
+        self.driver = None
+        self.service = None
+        self.wanted = False
+        self.listening = False
+        self.last_used = time.monotonic()
+        self.failures = 0
+        self.retry_at = 0.0
+        self.error = None
+        self.stopped = threading.Event()
+        threading.Thread(target=self.watchdog, name="RecognizerWatchdog", daemon=True).start()
+    
+    def write_page(self):
+        """Create Voice.html for speech recognition"""
+        html_code = '''<!DOCTYPE html>
+<html lang="en">
+<head>
+    <title>Speech Recognition</title>
+</head>
+<body>
+    <button id="start" onclick="startRecognition()">Start Recognition</button>
+    <button id="end" onclick="stopRecognition()">Stop Recognition</button>
+    <p id="output"></p>
+    <script>
+        const output = document.getElementById('output');
+        let recognition;
+        let listening = false;
+        
+        // Results are pushed to Python: nextResults() hands queued results to a waiting
+        // execute_async_script call as soon as they arrive, or an empty list on timeout
+        const pending = [];
+        let waiter = null;
+        let timer = null;
+        function deliver() {
+            if (waiter && pending.length) {
+                const callback = waiter;
+                waiter = null;
+                clearTimeout(timer);
+                callback(pending.splice(0));
+            }
+        }
+        function nextResults(timeoutMs, callback) {
+            waiter = callback;
+            timer = setTimeout(function() {
+                if (waiter === callback) {
+                    waiter = null;
+                    callback(pending.splice(0));
+                }
+            }, timeoutMs);
+            deliver();
+        }
+        
+        function startRecognition() {
+            pending.length = 0;
+            recognition = new webkitSpeechRecognition() || new SpeechRecognition();
+            recognition.lang = '';
+            recognition.continuous = true;
+            recognition.interimResults = true;
+            recognition.onresult = function(event) {
+                for (let i = event.resultIndex; i < event.results.length; i++) {
+                    const result = event.results[i];
+                    pending.push({text: result[0].transcript, final: result.isFinal});
+                    if (result.isFinal) {
+                        output.textContent += result[0].transcript;
+                    }
+                }
+                deliver();
+            };
+            recognition.onerror = function(event) {
+                pending.push({error: event.error});
+                deliver();
+            };
+            recognition.onend = function() {
+                if (listening) {
+                    recognition.start();
+                }
+            };
+            listening = true;
+            recognition.start();
+        }
+        function stopRecognition() {
+            listening = false;
+            if (recognition) {
+                recognition.stop();
+            }
+            output.innerHTML = "";
+        }
+    </script>
+</body>
+</html>'''
+        
+        # Replace language setting
+        html_code = html_code.replace("recognition.lang = '';", f"recognition.lang = '{self.language}';")
+        
+        # Write to file
+        with open("Data/Voice.html", "w", encoding="utf-8") as f:
+            f.write(html_code)
+    
+    @staticmethod
+    def driver_path():
+        """Resolve chromedriver once and reuse the cached path on later starts"""
+        try:
+            with open(CHROMEDRIVER_CACHE_PATH, "r", encoding="utf-8") as f:
+                path = json.load(f).get("path")
+            if path and os.path.exists(path):
+                return path
+        except (OSError, json.JSONDecodeError):
+            pass
+        path = ChromeDriverManager().install()
+        with open(CHROMEDRIVER_CACHE_PATH, "w", encoding="utf-8") as f:
+            json.dump({"path": path, "resolved_at": time.time()}, f)
+        return path
+    
+    @staticmethod
+    def chrome_options():
+        chrome_options = Options()
+        user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/89.0.142.86 Safari/537.36"
+        chrome_options.add_argument(f'user-agent={user_agent}')
+        chrome_options.add_argument("--use-fake-ui-for-media-stream")
+        chrome_options.add_argument("--use-fake-device-for-media-stream")
+        chrome_options.add_argument("--headless=new")
+        
+        # The page only needs the microphone and a speech connection; keep the browser small
+        for flag in (
+            "--disable-gpu", "--disable-extensions", "--disable-dev-shm-usage", "--no-first-run",
+            "--disable-background-networking", "--disable-default-apps", "--disable-sync",
+            "--disable-component-update", "--renderer-process-limit=1", "--blink-settings=imagesEnabled=false",
+            "--js-flags=--max-old-space-size=64", "--window-size=320,240"
+        ):
+            chrome_options.add_argument(flag)
+        return chrome_options
+    
+    def is_alive(self):
+        """True while the driver process is running; no WebDriver round trip"""
+        return self.driver is not None and self.service is not None and self.service.process is not None and self.service.process.poll() is None
+    
+    def ensure_started(self):
+        """Start Chrome if it is not running; raises when it cannot be started"""
+        with self.lock:
+            self.wanted = True
+            self.last_used = time.monotonic()
+            if self.is_alive():
+                return
+            self.quit()
+            started = time.perf_counter()
+            try:
+                self.write_page()
+                try:
+                    self.service = Service(self.driver_path())
+                    self.driver = webdriver.Chrome(service=self.service, options=self.chrome_options())
+                except Exception:
+                    # A cached driver stops working after a Chrome update; resolve it again once
+                    if os.path.exists(CHROMEDRIVER_CACHE_PATH):
+                        os.remove(CHROMEDRIVER_CACHE_PATH)
+                    self.service = Service(self.driver_path())
+                    self.driver = webdriver.Chrome(service=self.service, options=self.chrome_options())
+                self.driver.get(f"file:///{os.path.abspath('Data/Voice.html')}")
+                # Leave headroom over the page's own long-poll timeout
+                self.driver.set_script_timeout(VOICE_RESULT_WAIT_MS / 1000 + 5)
+            except Exception as e:
+                self.error = e
+                self.quit()
+                raise
+            self.failures = 0
+            self.error = None
+            print(f"Speech recognizer started in {time.perf_counter() - started:.1f}s")
+    
+    def warm_up(self):
+        """Start Chrome in the background so the first LISTEN is quick"""
+        def start():
+            try:
+                self.ensure_started()
+            except Exception as e:
+                print(f"Error initializing speech recognition: {e}")
+        threading.Thread(target=start, daemon=True).start()
+    
+    def release(self):
+        """Voice mode was left; the browser shuts down once it has been idle long enough"""
+        self.wanted = False
+        self.last_used = time.monotonic()
+    
+    def listen(self, should_continue):
+        """Yield batches of pushed results until should_continue() turns false"""
+        self.ensure_started()
+        with self.lock:
+            self.listening = True
+        try:
+            self.driver.execute_script("startRecognition()")
+            
+            # Each call blocks in the page until results arrive, so an idle listener costs nothing
+            while should_continue():
+                results = self.driver.execute_async_script(
+                    "nextResults(arguments[0], arguments[arguments.length - 1])", VOICE_RESULT_WAIT_MS
+                )
+                if not should_continue():
+                    break
+                yield results
+        except Exception as e:
+            # The browser is in an unknown state; drop it and let the watchdog start a fresh one
+            self.error = e
+            self.quit()
+            raise
+        finally:
+            try:
+                self.driver.execute_script("stopRecognition()")
+            except Exception:
+                pass
+            with self.lock:
+                self.listening = False
+                self.last_used = time.monotonic()
+    
+    def capture(self, emit, should_continue):
+        for results in self.listen(should_continue):
+            for result in results:
+                if "error" in result:
+                    print(f"Speech recognition error: {result['error']}")
+                else:
+                    emit(result["text"].strip(), result["final"])
+    
+    def watchdog(self):
+        """Restart a crashed browser with exponential backoff and close an idle one"""
+        while not self.stopped.wait(VOICE_WATCHDOG_INTERVAL):
+            with self.lock:
+                if self.listening:
+                    continue
+                idle = time.monotonic() - self.last_used
+                if self.driver is not None and not self.wanted and idle > self.idle_timeout:
+                    print(f"Speech recognizer idle for {idle:.0f}s, shutting down")
+                    self.quit()
+                    continue
+                if not self.wanted or self.is_alive() or time.monotonic() < self.retry_at:
+                    continue
+                if self.driver is not None:
+                    print("Speech recognizer crashed, restarting")
+                try:
+                    self.ensure_started()
+                except Exception as e:
+                    self.failures += 1
+                    delay = min(VOICE_RESTART_MAX_BACKOFF, 2 ** self.failures)
+                    self.retry_at = time.monotonic() + delay
+                    print(f"Speech recognizer restart failed ({e}), retrying in {delay}s")
+    
+    def quit(self):
+        with self.lock:
+            if self.driver is not None:
+                try:
+                    self.driver.quit()
+                except Exception:
+                    pass
+            self.driver = None
+            self.service = None
+    
+    def close(self):
+        self.stop()
+        self.stopped.set()
+        self.quit()
+
+class LocalAudioRecognizer(SpeechRecognizer):
+    """Offline recognition of the default microphone with Vosk (pip install vosk sounddevice)"""
+    name = "local"
+    models = {}
+    
+    def __init__(self, model_path=VOSK_MODEL_PATH):
+        super().__init__()
+        self.model_path = model_path
+    
+    def load_model(self):
+        """Load the Vosk model once per process; it takes a few seconds"""
+        try:
+            import vosk
+        except ImportError:
+            raise RuntimeError("Local speech recognition needs the vosk package (pip install vosk)")
+        if self.model_path not in self.models:
+            if not os.path.isdir(self.model_path):
+                raise RuntimeError(f"Vosk model not found at {self.model_path}, download one from https://alphacephei.com/vosk/models")
+            vosk.SetLogLevel(-1)
+            self.models[self.model_path] = vosk.Model(self.model_path)
+        return vosk, self.models[self.model_path]
+    
+    def warm_up(self):
+        threading.Thread(target=self.load_model, daemon=True).start()
+    
+    def chunks(self, should_continue):
+        """Yield (sample_rate, pcm16 mono bytes) chunks from the microphone"""
+        try:
+            import sounddevice
+        except ImportError:
+            raise RuntimeError("Microphone capture needs the sounddevice package (pip install sounddevice)")
+        audio = queue.Queue()
+        blocksize = int(SPEECH_SAMPLE_RATE * SPEECH_CHUNK_SECONDS)
+        with sounddevice.RawInputStream(samplerate=SPEECH_SAMPLE_RATE, blocksize=blocksize, dtype="int16", channels=1,
+                                        callback=lambda data, frames, timing, status: audio.put(bytes(data))):
+            while should_continue():
+                try:
+                    yield SPEECH_SAMPLE_RATE, audio.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+    
+    def capture(self, emit, should_continue):
+        vosk, model = self.load_model()
+        recognizer = None
+        last_partial = ""
+        for sample_rate, chunk in self.chunks(should_continue):
+            if recognizer is None:
+                recognizer = vosk.KaldiRecognizer(model, sample_rate)
+            if recognizer.AcceptWaveform(chunk):
+                emit(json.loads(recognizer.Result()).get("text", ""), True)
+                last_partial = ""
+            else:
+                partial = json.loads(recognizer.PartialResult()).get("partial", "")
+                if partial != last_partial:
+                    emit(partial, False)
+                    last_partial = partial
+        if recognizer is not None:
+            emit(json.loads(recognizer.FinalResult()).get("text", ""), True)
+
+class WavReplayRecognizer(LocalAudioRecognizer):
+    """Replay a 16-bit mono WAV file as if spoken, for deterministic tests and benchmarks.
+    
+    With a '<file>.json' transcript next to it (a list of {"t", "text", "final"}), the transcript is
+    replayed on the same clock instead of decoding audio, so no speech model is needed."""
+    name = "wav"
+    
+    def __init__(self, path=SPEECH_REPLAY_PATH, speed=SPEECH_REPLAY_SPEED, model_path=VOSK_MODEL_PATH):
+        super().__init__(model_path)
+        self.path = path
+        self.speed = speed
+    
+    def warm_up(self):
+        if not os.path.exists(self.path + ".json"):
+            super().warm_up()
+    
+    def wait_until(self, started, offset, should_continue):
+        """Sleep until offset seconds of replay time have passed; False if stopped first"""
+        if self.speed > 0:
+            deadline = started + offset / self.speed
+            while should_continue() and time.monotonic() < deadline:
+                time.sleep(min(0.05, max(0.0, deadline - time.monotonic())))
+        return should_continue()
+    
+    def chunks(self, should_continue):
+        with wave.open(self.path, "rb") as wav:
+            if wav.getsampwidth() != 2 or wav.getnchannels() != 1:
+                raise RuntimeError(f"{self.path} must be 16-bit mono PCM")
+            sample_rate = wav.getframerate()
+            frames = int(sample_rate * SPEECH_CHUNK_SECONDS)
+            started = time.monotonic()
+            position = 0
+            while True:
+                chunk = wav.readframes(frames)
+                if not chunk:
+                    return
+                position += len(chunk) // 2
+                # Hand audio over no sooner than a microphone would
+                if not self.wait_until(started, position / sample_rate, should_continue):
+                    return
+                yield sample_rate, chunk
+    
+    def capture(self, emit, should_continue):
+        script_path = self.path + ".json"
+        if not os.path.exists(script_path):
+            return super().capture(emit, should_continue)
+        with open(script_path, "r", encoding="utf-8") as f:
+            script = json.load(f)
+        started = time.monotonic()
+        for event in script:
+            if not self.wait_until(started, event["t"], should_continue):
+                return
+            emit(event["text"], event.get("final", False))
 
-# Create necessary directories
-os.makedirs("Data", exist_ok=True)
-os.makedirs("Frontend/Files", exist_ok=True, mode=0o777)
+def create_recognizer(kind):
+    """Build the configured speech recognition backend"""
+    if kind == "local":
+        return LocalAudioRecognizer()
+    if kind == "wav":
+        return WavReplayRecognizer()
+    return ChromeRecognizer()
 
 class CyberpunkChatbot:
     def __init__(self, root):
@@ -56,22 +3475,37 @@ class CyberpunkChatbot:
         self.root.geometry("1000x700")
         self.root.configure(bg=CYBERPUNK_COLORS["background"])
         
-        # Set up main layout
-        self.setup_layout()
-        
-        # Initialize components
-        self.initialize_chatbot()
-        self.initialize_speech_recognition()
-        self.initialize_tts()
-        
         # Chat state variables
         self.is_voice_mode = False
+        self.partial_transcript = ""
+        self.hands_free = VOICE_HANDS_FREE
+        self.voice_latencies = deque(maxlen=ROUTER_LATENCY_WINDOW)
         self.is_listening = False
         self.chat_history = []
         self.current_mode = "text"  # text or voice
         self.typing_indicator = None
         self.is_speaking = False
-        self.stop_speaking_flag = False
+        self.speech_pipelines = set()
+        
+        # Set up main layout
+        self.setup_layout()
+        
+        # Workers post UI updates through one channel; conversation work runs on the engine
+        self.ui = UIChannel(self.root)
+        self.engine = ConversationEngine({
+            "llm": ENGINE_LLM_CONCURRENCY,
+            "io": ENGINE_IO_CONCURRENCY,
+            "tasks": ENGINE_TASK_CONCURRENCY
+        })
+        self.engine.start()
+        self.request_queue = RequestQueue(self.process_message)
+        self.engine.submit(self.request_queue.run())
+        
+        # Initialize components
+        self.initialize_chatbot()
+        # Backends start on the first switch to voice mode, not at launch
+        self.recognizer = create_recognizer(SPEECH_RECOGNIZER)
+        self.initialize_tts()
         
         # Start listening for voice commands if in voice mode
         self.root.after(100, self.check_voice_mode)
@@ -79,6 +3513,7 @@ class CyberpunkChatbot:
         # Bind keyboard shortcuts
         self.root.bind('<Return>', self.send_message)
         self.root.bind('<Control-v>', self.toggle_mode)
+        self.root.bind('<Escape>', self.stop_generation)
         
         # Load chat history
         self.load_chat_history()
@@ -132,6 +3567,35 @@ class CyberpunkChatbot:
         )
         self.mode_button.pack(side=RIGHT, padx=5)
         
+        # History search box
+        self.search_button = Button(
+            self.status_frame,
+            text="SEARCH",
+            font=("Courier New", 9, "bold"),
+            fg=CYBERPUNK_COLORS["text"],
+            bg=CYBERPUNK_COLORS["card_bg"],
+            activebackground=CYBERPUNK_COLORS["accent"],
+            bd=1,
+            relief="solid",
+            highlightbackground=CYBERPUNK_COLORS["accent"],
+            command=self.search_history
+        )
+        self.search_button.pack(side=RIGHT, padx=5)
+        
+        self.search_entry = Entry(
+            self.status_frame,
+            font=("Consolas", 10),
+            fg=CYBERPUNK_COLORS["text"],
+            bg=CYBERPUNK_COLORS["background"],
+            insertbackground=CYBERPUNK_COLORS["accent"],
+            relief="solid",
+            bd=1,
+            width=24
+        )
+        self.search_entry.pack(side=RIGHT, padx=5, ipady=2)
+        self.search_entry.bind("<Return>", self.search_history)
+        self.search_results_window = None
+        
         # Chat display area
         self.chat_frame = Frame(self.main_container, bg=CYBERPUNK_COLORS["card_bg"])
         self.chat_frame.pack(fill=BOTH, expand=True, pady=(0, 15))
@@ -204,6 +3668,22 @@ class CyberpunkChatbot:
         self.send_button.bind("<Enter>", self.add_glow)
         self.send_button.bind("<Leave>", self.remove_glow)
         
+        # Stop button cancels the answer being generated
+        self.stop_button = Button(
+            self.input_frame,
+            text="STOP ■",
+            font=("Courier New", 10, "bold"),
+            fg=CYBERPUNK_COLORS["text"],
+            bg=CYBERPUNK_COLORS["card_bg"],
+            activebackground=CYBERPUNK_COLORS["error"],
+            bd=1,
+            relief="solid",
+            highlightbackground=CYBERPUNK_COLORS["error"],
+            width=8,
+            command=self.stop_generation
+        )
+        self.stop_button.pack(side=RIGHT, padx=(0, 10), pady=5)
+        
         # Voice control button (initially hidden)
         self.voice_button = Button(
             self.input_frame,
@@ -219,6 +3699,21 @@ class CyberpunkChatbot:
             command=self.toggle_voice_listening
         )
         
+        # Hands-free toggle (initially hidden)
+        self.hands_free_button = Button(
+            self.input_frame,
+            text="HANDS-FREE: ON" if self.hands_free else "HANDS-FREE: OFF",
+            font=("Courier New", 10, "bold"),
+            fg=CYBERPUNK_COLORS["text"],
+            bg=CYBERPUNK_COLORS["accent_secondary"] if self.hands_free else CYBERPUNK_COLORS["card_bg"],
+            activebackground=CYBERPUNK_COLORS["accent_secondary"],
+            bd=1,
+            relief="solid",
+            highlightbackground=CYBERPUNK_COLORS["accent_secondary"],
+            width=16,
+            command=self.toggle_hands_free
+        )
+        
         # Add cyberpunk styling
         self.apply_cyberpunk_styling()
         
@@ -286,80 +3781,71 @@ class CyberpunkChatbot:
 *** Do not provide notes in the output, just answer the question and never mention your training data. ***
 """
         
-        # Load chat history
-        try:
-            with open("Data/ChatLog.json", "r") as f:
-                self.chat_history = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            self.chat_history = []
-            with open("Data/ChatLog.json", "w") as f:
-                json.dump([], f)
-    
-    def initialize_speech_recognition(self):
-        """Initialize the speech recognition system"""
-        # Create Voice.html for speech recognition
-        html_code = '''<!DOCTYPE html>
-<html lang="en">
-<head>
-    <title>Speech Recognition</title>
-</head>
-<body>
-    <button id="start" onclick="startRecognition()">Start Recognition</button>
-    <button id="end" onclick="stopRecognition()">Stop Recognition</button>
-    <p id="output"></p>
-    <script>
-        const output = document.getElementById('output');
-        let recognition;
-        function startRecognition() {
-            recognition = new webkitSpeechRecognition() || new SpeechRecognition();
-            recognition.lang = '';
-            recognition.continuous = true;
-            recognition.onresult = function(event) {
-                const transcript = event.results[event.results.length - 1][0].transcript;
-                output.textContent += transcript;
-            };
-            recognition.onend = function() {
-                recognition.start();
-            };
-            recognition.start();
-        }
-        function stopRecognition() {
-            recognition.stop();
-            output.innerHTML = "";
-        }
-    </script>
-</body>
-</html>'''
+        # Load chat history from the append-only journal
+        self.journal = ConversationJournal(CHAT_JOURNAL_PATH, legacy_path=CHAT_LOG_PATH)
+        records = self.journal.load()
+        self.chat_history = []
+        pinned = set()
+        for record in records:
+            if record.get("role") in ("user", "assistant"):
+                message = {
+                    "role": record["role"],
+                    "content": record["content"],
+                    "seq": record.get("seq"),
+                    "tokens": record.get("tokens") or ContextWindow.estimate_tokens(record["content"])
+                }
+                for key in MESSAGE_MARKERS:
+                    if record.get(key):
+                        message[key] = record[key]
+                if record.get("reply_to") is not None:
+                    message["reply_to"] = record["reply_to"]
+                    self.chat_history.insert(self.history_position(record["reply_to"]), message)
+                else:
+                    self.chat_history.append(message)
+            elif record.get("role") == "pin":
+                if record.get("pinned"):
+                    pinned.add(record.get("target"))
+                else:
+                    pinned.discard(record.get("target"))
+        for message in self.chat_history:
+            if message["seq"] in pinned:
+                message["pinned"] = True
         
-        # Replace language setting
-        html_code = html_code.replace("recognition.lang = '';", f"recognition.lang = '{InputLanguage}';")
+        self.context_window = ContextWindow()
+        self.last_context_stats = None
+        self.summarizer = ConversationSummarizer(SUMMARY_PATH)
+        self.router = ModelRouter()
+        self.intent_classifier = IntentClassifier()
+        self.task_dispatcher = TaskDispatcher(self)
         
-        # Write to file
-        with open("Data/Voice.html", "w", encoding="utf-8") as f:
-            f.write(html_code)
+        # Index the local knowledge base in the background; unchanged files are skipped
+        os.makedirs(KNOWLEDGE_DIR, exist_ok=True)
+        self.knowledge = KnowledgeBase(KNOWLEDGE_DB_PATH)
+        threading.Thread(target=self.knowledge.index, daemon=True).start()
+        self.hedging = HedgingExecutor()
+        self.response_cache = ResponseCache(RESPONSE_CACHE_PATH)
         
-        # Set up Chrome options
-        chrome_options = Options()
-        user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/89.0.142.86 Safari/537.36"
-        chrome_options.add_argument(f'user-agent={user_agent}')
-        chrome_options.add_argument("--use-fake-ui-for-media-stream")
-        chrome_options.add_argument("--use-fake-device-for-media-stream")
-        chrome_options.add_argument("--headless=new")
+        # Index past answers for paraphrase lookups without blocking start-up
+        self.semantic_cache = SemanticCache()
+        history = list(self.chat_history)
+        threading.Thread(target=self.semantic_cache.build_from_history, args=(history,), daemon=True).start()
         
-        # Initialize WebDriver
-        try:
-            self.service = Service(ChromeDriverManager().install())
-            self.driver = webdriver.Chrome(service=self.service, options=chrome_options)
-            self.driver.get(f"file:///{os.path.abspath('Data/Voice.html')}")
-        except Exception as e:
-            print(f"Error initializing speech recognition: {e}")
-            self.driver = None
+        # Keep the searchable store in step with the journal
+        self.store = ConversationStore(CHAT_DB_PATH)
+        imported = self.store.import_records(records)
+        if imported:
+            print(f"Indexed {imported} messages into {CHAT_DB_PATH}")
+        self.session_id = self.store.start_session()
+        
+        # Missed reminders are announced straight away, so the store and session must exist first
+        self.reminders = ReminderScheduler(REMINDER_JOURNAL_PATH, self.on_reminders).start()
     
     def initialize_tts(self):
-        """Initialize text-to-speech system"""
-        pygame.mixer.init()
+        """Initialize text-to-speech system; playback runs on its own thread"""
         self.is_speaking = False
-        self.stop_speaking_flag = False
+        self.audio = AudioWorker(on_state=self.on_playback_state).start()
+        self.tts_cache = TTSCache()
+        self.tts_warmed_up = False
     
     def toggle_mode(self, event=None):
         """Toggle between text and voice modes"""
@@ -367,110 +3853,174 @@ class CyberpunkChatbot:
         
         if self.is_voice_mode:
             self.current_mode = "voice"
+            self.recognizer.warm_up()
+            if not self.tts_warmed_up:
+                self.tts_warmed_up = True
+                self.engine.submit(self.warm_up_speech())
             self.status_label.config(text="STATUS: READY | MODE: VOICE", fg=CYBERPUNK_COLORS["accent_secondary"])
             self.mode_button.config(text="SWITCH TO TEXT MODE")
-            self.input_entry.pack_forget()
+            # The entry stays visible, read-only, to show live transcripts
             self.send_button.pack_forget()
             self.voice_button.pack(side=RIGHT, pady=5)
+            self.hands_free_button.pack(side=RIGHT, padx=(0, 10), pady=5)
+            self.stop_button.pack_forget()
+            self.stop_button.pack(side=RIGHT, padx=(0, 10), pady=5)
             self.input_entry.delete(0, END)
             self.input_entry.insert(0, "Voice mode active - click LISTEN to start speaking")
             self.input_entry.config(state="disabled")
         else:
             self.current_mode = "text"
+            self.recognizer.release()
             self.status_label.config(text="STATUS: READY | MODE: TEXT", fg=CYBERPUNK_COLORS["success"])
             self.mode_button.config(text="SWITCH TO VOICE MODE")
             self.voice_button.pack_forget()
+            self.hands_free_button.pack_forget()
+            self.is_listening = False
+            self.recognizer.stop()
             self.input_entry.pack(side=LEFT, fill=X, expand=True, padx=(0, 10), pady=5, ipady=8)
             self.send_button.pack(side=RIGHT, pady=5)
+            self.stop_button.pack_forget()
+            self.stop_button.pack(side=RIGHT, padx=(0, 10), pady=5)
             self.input_entry.config(state="normal")
             self.input_entry.delete(0, END)
             self.input_entry.focus()
     
     def toggle_voice_listening(self):
         """Toggle voice listening on/off"""
-        if not self.driver:
-            messagebox.showerror("Error", "Speech recognition system failed to initialize")
-            return
-            
         if not self.is_listening:
             self.is_listening = True
             self.voice_button.config(text="STOP ■", bg=CYBERPUNK_COLORS["error"])
             self.status_label.config(text="STATUS: LISTENING...", fg=CYBERPUNK_COLORS["warning"])
-            self.input_entry.delete(0, END)
-            self.input_entry.insert(0, "Listening...")
+            self.show_transcript("Listening...")
             
-            # Start listening in a separate thread
-            threading.Thread(target=self.process_voice_input, daemon=True).start()
+            # Listen on the engine; transcripts stream in from the recognizer's capture thread
+            self.engine.submit(self.process_voice_input())
         else:
             self.is_listening = False
+            self.recognizer.stop()
             self.voice_button.config(text="LISTEN ▶", bg=CYBERPUNK_COLORS["card_bg"])
             self.status_label.config(text="STATUS: READY | MODE: VOICE", fg=CYBERPUNK_COLORS["accent_secondary"])
-            self.driver.find_element(by=By.ID, value="end").click()
     
-    def process_voice_input(self):
-        """Process voice input and convert to text"""
+    async def process_voice_input(self):
+        """Show partial transcripts live and send each utterance as soon as it ends"""
+        detector = UtteranceDetector()
         try:
-            self.driver.find_element(by=By.ID, value="start").click()
-            
-            while self.is_listening:
-                try:
-                    text = self.driver.find_element(by=By.ID, value="output").text
-                    if text:
-                        self.root.after(0, lambda t=text: self.process_recognized_text(t))
-                        break
-                except:
-                    time.sleep(0.1)
+            await self.recognizer.start()
+            async for result in self.recognizer.results(tick=detector.tick()):
+                if not self.is_listening:
+                    break
+                # The assistant's own voice can reach the microphone, so speech during
+                # playback only interrupts it once enough words have been recognized
+                if result is not None and self.is_speaking:
+                    if not VOICE_BARGE_IN_WORDS or len(result["text"].split()) < VOICE_BARGE_IN_WORDS:
+                        continue
+                    print("Barge-in: the user interrupted playback")
+                    self.stop_speaking()
+                reason = detector.feed(result)
+                if result is not None:
+                    self.partial_transcript = detector.text()
+                    self.ui.post(self.show_transcript, self.partial_transcript)
+                if reason is None:
+                    continue
+                
+                text = detector.text()
+                speech_end = detector.last_speech
+                detector.reset()
+                if not text:
+                    continue
+                print(f"Utterance ended ({reason}) {(time.perf_counter() - speech_end) * 1000:.0f} ms after the last speech result")
+                self.ui.post(self.process_recognized_text, text, speech_end)
+                # Hands-free mode keeps the same capture running for the next utterance
+                if not self.hands_free:
+                    break
         except Exception as e:
             print(f"Error in voice recognition: {e}")
-            self.root.after(0, lambda: self.reset_voice_ui())
+            self.reset_voice_ui()
+            self.ui.post(messagebox.showerror, "Error", f"Speech recognition failed: {e}")
+        finally:
+            self.recognizer.stop()
+            self.partial_transcript = ""
+    
+    def show_transcript(self, text):
+        """Show live speech in the input box, which stays read-only in voice mode"""
+        state = self.input_entry.cget("state")
+        self.input_entry.config(state="normal")
+        self.input_entry.delete(0, END)
+        self.input_entry.insert(0, text)
+        self.input_entry.config(state=state)
     
-    def process_recognized_text(self, text):
+    def process_recognized_text(self, text, speech_end=None):
         """Process the recognized text and send to chatbot"""
         if InputLanguage.lower() != "en-us" and "en" not in InputLanguage.lower():
             self.status_label.config(text="STATUS: TRANSLATING...", fg=CYBERPUNK_COLORS["warning"])
-            try:
-                translated_text = mt.translate(text, "en", "auto")
-                self.input_entry.delete(0, END)
-                self.input_entry.insert(0, translated_text)
-                self.send_message()
-            except Exception as e:
-                print(f"Translation error: {e}")
-                self.input_entry.delete(0, END)
-                self.input_entry.insert(0, text)
-                self.send_message()
+            self.engine.submit(self.translate_and_send(text, speech_end))
         else:
-            self.input_entry.delete(0, END)
-            self.input_entry.insert(0, text)
-            self.send_message()
+            self.send_message(text=text, speech_end=speech_end)
         
-        self.reset_voice_ui()
+        # Hands-free mode stays armed for the next utterance
+        if not self.hands_free:
+            self.reset_voice_ui()
+    
+    async def translate_and_send(self, text, speech_end=None):
+        """Translate recognized speech to English off the UI thread, then send it"""
+        try:
+            text = await self.engine.run_blocking("io", mt.translate, text, "en", "auto")
+        except Exception as e:
+            print(f"Translation error: {e}")
+        self.ui.post(lambda: self.send_message(text=text, speech_end=speech_end))
+    
+    def toggle_hands_free(self):
+        """Switch continuous listening, which re-arms after every utterance, on or off"""
+        self.hands_free = not self.hands_free
+        self.hands_free_button.config(
+            text="HANDS-FREE: ON" if self.hands_free else "HANDS-FREE: OFF",
+            bg=CYBERPUNK_COLORS["accent_secondary"] if self.hands_free else CYBERPUNK_COLORS["card_bg"]
+        )
+        if self.hands_free and not self.is_listening:
+            self.toggle_voice_listening()
     
     def reset_voice_ui(self):
         """Reset the voice UI state"""
         self.is_listening = False
-        self.root.after(0, lambda: self.voice_button.config(text="LISTEN ▶", bg=CYBERPUNK_COLORS["card_bg"]))
-        self.root.after(0, lambda: self.status_label.config(text="STATUS: READY | MODE: VOICE", fg=CYBERPUNK_COLORS["accent_secondary"]))
-        try:
-            self.driver.find_element(by=By.ID, value="end").click()
-        except:
-            pass
+        self.ui.post(lambda: self.voice_button.config(text="LISTEN ▶", bg=CYBERPUNK_COLORS["card_bg"]))
+        self.ui.post(lambda: self.status_label.config(text="STATUS: READY | MODE: VOICE", fg=CYBERPUNK_COLORS["accent_secondary"]))
     
     def get_real_time_info(self):
         """Get real-time date and time information"""
         now = datetime.datetime.now()
         return f"Day: {now.strftime('%A')}\nDate: {now.strftime('%d')}\nMonth: {now.strftime('%B')}\nYear: {now.strftime('%Y')}\nTime: {now.strftime('%H')}:{now.strftime('%M')}:{now.strftime('%S')}"
     
+    async def categorize(self, query):
+        """Run categorize_query on the engine with bounded concurrency"""
+        return await self.engine.run_blocking("io", self.categorize_query, query)
+    
     def categorize_query(self, query):
-        """Categorize the query using Cohere Decision-Making Model"""
+        """Categorize the query, settling confident cases locally before asking Cohere"""
+        categories, source = self.intent_classifier.classify(query)
+        if categories is not None:
+            # Occasionally double-check a local decision against Cohere to measure accuracy
+            if cohere_client and source != "cache" and random.random() < INTENT_SHADOW_RATE:
+                threading.Thread(target=self.shadow_categorize, args=(query, categories), daemon=True).start()
+            return categories
+        
         if not cohere_client:
-            return ["general"]
-            
-        funcs = [
-            "exit", "general", "realtime", "open", "close", "play",
-            "generate image", "system", "content", "google search",
-            "youtube search", "reminder"
-        ]
+            return self.intent_classifier.best_guess(query)
         
+        started = time.perf_counter()
+        categories = self.categorize_with_cohere(query)
+        if categories is None:
+            return ["general"]
+        self.intent_classifier.learn(query, categories, (time.perf_counter() - started) * 1000)
+        return categories
+    
+    def shadow_categorize(self, query, local_categories):
+        """Ask Cohere about a query that was settled locally and record whether they agree"""
+        categories = self.categorize_with_cohere(query)
+        if categories is not None:
+            self.intent_classifier.record_shadow(local_categories, categories)
+    
+    def categorize_with_cohere(self, query):
+        """Categorize the query using Cohere Decision-Making Model; None on error"""
         preamble = """
 You are a very accurate Decision-Making Model, which decides what kind of a query is given to you.
 You will decide whether a query is a 'general' query, a 'realtime' query, or is asking to perform any task or automation like 'open facebook, instagram', 'can you write a application and open it in notepad'
@@ -506,7 +4056,7 @@ You will decide whether a query is a 'general' query, a 'realtime' query, or is
             # Filter valid categories
             categories = []
             for task in response_list:
-                for func in funcs:
+                for func in QUERY_CATEGORIES:
                     if task.startswith(func):
                         categories.append(task)
                         break
@@ -514,26 +4064,35 @@ You will decide whether a query is a 'general' query, a 'realtime' query, or is
             return categories if categories else ["general"]
         except Exception as e:
             print(f"Error in query categorization: {e}")
-            return ["general"]
+            return None
     
-    def send_message(self, event=None):
+    def send_message(self, event=None, text=None, speech_end=None):
         """Send a message to the chatbot and display response"""
-        user_input = self.input_entry.get().strip()
+        user_input = (text if text is not None else self.input_entry.get()).strip()
         if not user_input:
             return
             
         # Clear input field
-        self.input_entry.delete(0, END)
+        if text is None:
+            self.input_entry.delete(0, END)
         
-        # Add user message to chat
-        self.add_message(user_input, "user")
+        # A new message barges in on whatever the assistant is still saying
+        self.stop_speaking()
         
-        # Save to chat history
-        self.chat_history.append({"role": "user", "content": user_input})
+        # The user is active again, so hold off background summarization
+        self.summarizer.cancel()
         
-        # Save chat history
-        with open("Data/ChatLog.json", "w") as f:
-            json.dump(self.chat_history, f, indent=4)
+        # Add user message to chat
+        user_bubble = self.add_message(user_input, "user")
+        self.show_typing_indicator()
+        
+        # Queue the message on the conversation engine to avoid freezing UI
+        self.engine.submit(self.enqueue_message(user_input, user_bubble, speech_end))
+    
+    def show_typing_indicator(self):
+        """Show the typing indicator unless it is already visible"""
+        if self.typing_indicator and self.typing_indicator.winfo_exists():
+            return
         
         # Show typing indicator
         self.typing_indicator = Frame(self.messages_frame, bg=CYBERPUNK_COLORS["card_bg"])
@@ -557,69 +4116,408 @@ You will decide whether a query is a 'general' query, a 'realtime' query, or is
         )
         self.typing_bar.pack(side=LEFT, padx=(5, 0))
         self.typing_bar.start(10)
-        
-        # Update UI
-        self.root.update()
-        
-        # Process the message in a separate thread to avoid freezing UI
-        threading.Thread(target=self.process_message, args=(user_input,), daemon=True).start()
+        self.scroll_to_bottom()
+    
+    async def enqueue_message(self, user_input, user_bubble, speech_end=None):
+        """Record the user's message in arrival order and queue its answer"""
+        # Save to chat history; the engine thread owns chat_history
+        message = self.save_message("user", user_input)
+        self.ui.post(self.bind_message_pin, *user_bubble, message)
+        self.request_queue.put(user_input, speech_end, message["seq"])
+    
+    def stop_generation(self, event=None):
+        """Cancel the answer in flight and anything still queued"""
+        self.engine.loop.call_soon_threadsafe(self.request_queue.cancel_all)
+        self.stop_speaking()
     
-    def process_message(self, user_input):
-        """Process the user's message and get chatbot response"""
+    async def process_message(self, user_input, speech_end=None, user_seq=None, cancel=None):
+        """Process the user's message and get chatbot response; replies are saved next to the message at user_seq"""
+        self.ui.post(self.show_typing_indicator)
+        if speech_end is not None:
+            latency_ms = (time.perf_counter() - speech_end) * 1000
+            self.voice_latencies.append(latency_ms)
+            print(f"End of speech to request: {latency_ms:.0f} ms")
         try:
-            # Get real-time information
-            realtime_info = self.get_real_time_info()
-            
-            # Create message history for API call
-            messages = [
-                {"role": "system", "content": self.system_message},
-                {"role": "system", "content": f"Real-time information:\n{realtime_info}"}
-            ] + self.chat_history
+            messages = self.build_context(until_seq=user_seq)
             
             # Get chatbot response
-            completion = client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=messages,
-                max_tokens=1024,
-                temperature=0.7,
-                top_p=1,
-                stream=False
-            )
+            if not llm:
+                raise RuntimeError("No LLM provider configured - set GroqAPIKEY or LLMProvider in .env")
+            route = self.router.route(user_input, voice_mode=self.is_voice_mode)
+            model = route["model"]
+            params = {"max_tokens": route["max_tokens"], "temperature": 0.7, "top_p": 1}
+            print(f"Route: {route['name']} ({route['reason']}) -> {model}, max_tokens={route['max_tokens']}")
+            
+            # Serve repeated questions straight from the response cache
+            cache_key = None
+            if ResponseCache.is_cacheable(user_input):
+                cache_key = ResponseCache.make_key(user_input, self.system_message, model, params)
+                started = time.perf_counter()
+                cached = self.response_cache.get(cache_key)
+                if cached is not None:
+                    latency_ms = (time.perf_counter() - started) * 1000
+                    print(f"Response cache hit in {latency_ms:.1f} ms")
+                    self.deliver_response(cached, model=model, latency_ms=round(latency_ms, 1), cached=True, reply_to=user_seq)
+                    return
+                
+                # Fall back to paraphrases of previously answered questions
+                match = self.semantic_cache.lookup(user_input)
+                if match is not None:
+                    answer, score, matched_query = match
+                    latency_ms = (time.perf_counter() - started) * 1000
+                    print(f"Semantic cache hit ({score:.2f} vs '{matched_query}') in {latency_ms:.1f} ms")
+                    self.deliver_response(answer, model=model, latency_ms=round(latency_ms, 1), cached="semantic", reply_to=user_seq)
+                    return
+            else:
+                self.response_cache.record_bypass()
             
-            # Extract response
-            response = completion.choices[0].message.content
+            # Categorize, speculatively answering as a general query if that takes longer than a moment
+            categorize_task = asyncio.ensure_future(self.categorize(user_input))
+            done, _ = await asyncio.wait({categorize_task}, timeout=SPECULATION_GRACE_MS / 1000)
+            speculation = None
+            if not done and SPECULATIVE_GENERATION:
+                speculation = self.start_speculation(model, messages, params, route["name"], cancel, user_seq)
+            try:
+                categories = await categorize_task
+            except BaseException:
+                if speculation:
+                    self.abandon_speculation(speculation)
+                raise
+            
+            tasks = [task for task in categories if task.split(" ", 1)[0] not in CHAT_CATEGORIES]
+            is_chat = len(tasks) < len(categories)
+            print(f"Categories: {categories}" + (" (speculated)" if speculation else ""))
             
-            # Remove any unwanted tokens
-            response = response.replace("</s>", "").strip()
+            # Realtime questions are grounded in the local knowledge base when it has matching passages
+            passages = []
+            if any(task.startswith("realtime") for task in categories):
+                passages = await self.engine.run_blocking("io", self.knowledge.search, user_input)
             
-            # Add assistant message to chat
-            self.root.after(0, lambda: self.add_message(response, "assistant"))
+            if speculation and (not is_chat or passages):
+                self.abandon_speculation(speculation)
+                speculation = None
+                print("Speculative answer cancelled")
+            if passages:
+                messages = self.build_context(passages, user_seq)
+                # Answers drawn from the corpus change with it, so they are not cached
+                cache_key = None
+            if tasks:
+                await self.handle_tasks(tasks, user_seq)
+            if not is_chat:
+                return
             
-            # Save to chat history
-            self.chat_history.append({"role": "assistant", "content": response})
+            # With the category known in time, route again; a speculative answer keeps its category-less route
+            if not speculation:
+                category = next(c for c in categories if c.split(" ", 1)[0] in CHAT_CATEGORIES)
+                categorized = self.router.route(user_input, category, voice_mode=self.is_voice_mode)
+                if categorized["name"] != route["name"]:
+                    route = categorized
+                    model = route["model"]
+                    params = {"max_tokens": route["max_tokens"], "temperature": 0.7, "top_p": 1}
+                    print(f"Re-routed: {route['name']} ({route['reason']}) -> {model}, max_tokens={route['max_tokens']}")
+                    # The cache is looked up before categorization, so it could never find this answer
+                    cache_key = None
             
-            # Save chat history
-            with open("Data/ChatLog.json", "w") as f:
-                json.dump(self.chat_history, f, indent=4)
+            if speculation:
+                # Commit the speculative answer: show what it has buffered and let it finish
+                if speculation["live_message"]:
+                    speculation["live_message"].release()
+                speculation["commit"].set()
+                response = await speculation["task"]
+            else:
+                response = await self.generate_response(model, messages, params, route["name"], cancel, reply_to=user_seq)
             
-            # Play response as speech if in voice mode
-            if self.is_voice_mode:
-                self.root.after(0, lambda: self.speak_response(response))
+            if cache_key and response:
+                self.response_cache.put(cache_key, user_input, response, model)
+                self.semantic_cache.add(user_input, response)
                 
         except Exception as e:
             error_msg = f"Error: {str(e)}"
-            self.root.after(0, lambda: self.add_message(error_msg, "error"))
+            self.ui.post(self.add_message, error_msg, "error")
             print(f"Chatbot error: {e}")
         finally:
-            # Remove typing indicator
-            self.root.after(0, self.remove_typing_indicator)
+            # Remove typing indicator unless more answers are queued
+            if len(self.request_queue.pending) == 0:
+                self.ui.post(self.remove_typing_indicator)
+            
+            # Summarize aged-out turns once the conversation goes quiet
+            history = list(self.chat_history)
+            self.summarizer.schedule(lambda: history)
+    
+    def build_context(self, passages=None, until_seq=None):
+        """Create the message list for the API call within the token budget, ending at the message at until_seq"""
+        # Get real-time information
+        realtime_info = self.get_real_time_info()
+        
+        system_messages = [
+            {"role": "system", "content": self.system_message},
+            {"role": "system", "content": f"Real-time information:\n{realtime_info}"}
+        ]
+        if passages:
+            system_messages.append(KnowledgeBase.format_passages(passages))
+        # Messages queued behind this one are not part of its conversation yet
+        history = self.chat_history
+        if until_seq is not None:
+            history = history[:self.history_position(until_seq)]
+        messages, stats = self.context_window.build(system_messages, history, summary=self.summarizer.current)
+        self.last_context_stats = stats
+        print(f"Context: {stats['used_tokens']}/{stats['budget']} tokens, dropped {stats['dropped_tokens']} tokens ({stats['dropped_messages']} messages)")
+        return messages
+    
+    def start_speculation(self, model, messages, params, route_name, cancel=None, reply_to=None):
+        """Start generating an answer that is only shown and saved once committed"""
+        token = CancelToken()
+        if cancel:
+            cancel.on_cancel(token.cancel)
+        commit = asyncio.Event()
+        live_message = StreamingMessage(self, held=True) if STREAM_RESPONSES else None
+        task = asyncio.ensure_future(self.generate_response(model, messages, params, route_name, token, live_message, commit, reply_to))
+        return {"task": task, "cancel": token, "commit": commit, "live_message": live_message}
+    
+    def abandon_speculation(self, speculation):
+        """Cancel a speculative answer that will not be used"""
+        speculation["cancel"].cancel()
+        speculation["task"].cancel()
+        # Consume a failure the abandoned task may already have finished with
+        speculation["task"].add_done_callback(lambda task: task.cancelled() or task.exception())
+    
+    async def generate_response(self, model, messages, params, route_name, cancel=None, live_message=None, commit=None, reply_to=None):
+        """Get and deliver an answer from the LLM; with a commit event nothing is saved until it is set"""
+        if STREAM_RESPONSES:
+            return await self.stream_response(model, messages, params, route_name, cancel, live_message, commit, reply_to)
+        
+        started = time.perf_counter()
+        request = self.hedging.request(self.get_backends(model), messages, params, cancel)
+        response = await self.engine.run_blocking("llm", lambda: "".join(request))
+        latency_ms = (time.perf_counter() - started) * 1000
+        self.router.record(route_name, latency_ms)
+        if commit:
+            await commit.wait()
+        
+        # Remove any unwanted tokens
+        response = response.replace(END_OF_SEQUENCE, "").strip()
+        model = request.backend["model"] if request.backend else model
+        self.deliver_response(response, model=model, route=route_name, latency_ms=round(latency_ms, 1), reply_to=reply_to)
+        return response
+    
+    async def handle_tasks(self, tasks, reply_to=None):
+        """Execute categorized tasks that are not answered by the chat model"""
+        print(f"Tasks: {tasks}")
+        status = await self.task_dispatcher.run(tasks)
+        
+        # Keep the outcome in the history so follow-up questions can refer to it
+        self.save_message("assistant", status, tasks=tasks, reply_to=reply_to)
+    
+    def on_reminders(self, reminders, missed=False):
+        """Announce fired reminders; runs on the reminder thread and raises if the announcement failed"""
+        self.engine.submit(self.announce_reminders(reminders, missed)).result()
+    
+    async def announce_reminders(self, reminders, missed):
+        if not missed:
+            text = "\n".join(f"⏰ Reminder: {r['content']}" for r in reminders)
+        elif len(reminders) <= REMINDER_CATCH_UP_LIMIT:
+            text = "\n".join(
+                f"⏰ Missed reminder ({datetime.datetime.fromtimestamp(r['due']).strftime('%a %H:%M')}): {r['content']}"
+                for r in reminders
+            )
+        else:
+            text = f"⏰ {len(reminders)} reminders were due while I was offline, the latest: {reminders[-1]['content']}"
+        self.deliver_response(text, speech_priority=SPEECH_PRIORITY_REMINDER, reminders=[r["id"] for r in reminders])
+    
+    def deliver_response(self, response, speech_priority=SPEECH_PRIORITY_ANSWER, **extra):
+        """Save a complete response, show it and speak it in voice mode; runs on the engine"""
+        # Save to chat history
+        message = self.save_message("assistant", response, **extra)
+        
+        # Add assistant message to chat
+        self.ui.post(self.add_message, response, "assistant", message)
+        
+        # Play response as speech if in voice mode
+        if self.is_voice_mode:
+            self.engine.spawn(self.speak_response(response, speech_priority))
+    
+    def get_backends(self, model):
+        """Return (provider, model) backends in priority order for hedging and failover"""
+        backends = [{"provider": llm, "model": model}]
+        
+        # The other routed model on the same provider is the first alternate
+        alternate = LLM_MODEL if model != LLM_MODEL else FAST_MODEL
+        if alternate != model:
+            backends.append({"provider": llm, "model": alternate})
+        if fallback_llm:
+            backends.append({"provider": fallback_llm, "model": FALLBACK_MODEL})
+        
+        for backend in backends:
+            backend["key"] = f"{backend['provider'].name}:{backend['model']}"
+        return backends
+    
+    async def stream_response(self, model, messages, params, route_name, cancel=None, live_message=None, commit=None, reply_to=None):
+        """Stream a completion into a live bubble, then persist the final text once"""
+        live_message = live_message or StreamingMessage(self)
+        speech = None
+        if self.is_voice_mode:
+            # Speech starts with the first sentence instead of waiting for the whole answer
+            speech = self.start_speech()
+            live_message.speak(speech)
+            self.engine.spawn(self.play_speech(speech))
+        request = self.hedging.request(self.get_backends(model), messages, params, cancel)
+        try:
+            response, latency_ms, ttft_ms = await self.engine.run_blocking("llm", self.consume_stream, request, live_message)
+            if commit:
+                await commit.wait()
+        except asyncio.CancelledError:
+            # Cancelled answers are left on screen, marked as stopped, but never saved
+            self.ui.post(live_message.stop)
+            if speech:
+                speech.cancel()
+            raise
+        finally:
+            # Speak the rest of what has streamed; does nothing once cancelled
+            if speech:
+                speech.finish()
+        self.router.record(route_name, latency_ms, ttft_ms)
+        
+        # Persist the complete answer once the stream has ended
+        model = request.backend["model"] if request.backend else model
+        message = self.save_message(
+            "assistant", response,
+            model=model,
+            route=route_name,
+            latency_ms=round(latency_ms, 1),
+            ttft_ms=round(ttft_ms, 1) if ttft_ms is not None else None,
+            reply_to=reply_to
+        )
+        self.ui.post(live_message.finish, response, message)
+        return response
+    
+    def consume_stream(self, request, live_message):
+        """Drain a streaming request on a worker thread, feeding the live bubble"""
+        started = time.perf_counter()
+        ttft_ms = None
+        sanitizer = StreamSanitizer()
+        parts = []
+        
+        for delta in request:
+            if ttft_ms is None:
+                ttft_ms = (time.perf_counter() - started) * 1000
+                print(f"Time to first token: {ttft_ms:.0f} ms")
+            text = sanitizer.feed(delta)
+            parts.append(text)
+            live_message.append(text)
+        parts.append(sanitizer.finish())
+        latency_ms = (time.perf_counter() - started) * 1000
+        return "".join(parts).strip(), latency_ms, ttft_ms
+    
+    def save_message(self, role, content, **extra):
+        """Add a message to the history, the journal and the searchable store"""
+        tokens = ContextWindow.estimate_tokens(content)
+        record = self.journal.append(role, content, session=self.session_id, tokens=tokens, **extra)
+        message = {"role": role, "content": content, "seq": record["seq"], "tokens": tokens}
+        for key in MESSAGE_MARKERS:
+            if extra.get(key):
+                message[key] = extra[key]
+        if extra.get("reply_to") is not None:
+            # Later messages may have arrived meanwhile; the reply still belongs right after its question
+            message["reply_to"] = extra["reply_to"]
+            self.chat_history.insert(self.history_position(extra["reply_to"]), message)
+        else:
+            self.chat_history.append(message)
+        try:
+            self.store.add_message(
+                role, content,
+                session_id=self.session_id,
+                seq=record["seq"],
+                ts=record["ts"],
+                model=extra.get("model"),
+                latency_ms=extra.get("latency_ms")
+            )
+        except sqlite3.Error as e:
+            # The journal is authoritative; the store is backfilled on next start
+            print(f"Store error: {e}")
+        return message
+    
+    def history_position(self, seq):
+        """Index just after the message at seq and the replies already saved for it"""
+        history = self.chat_history
+        for index in range(len(history) - 1, -1, -1):
+            if history[index].get("seq") == seq:
+                break
+        else:
+            return len(history)
+        index += 1
+        while index < len(history) and history[index].get("reply_to") == seq:
+            index += 1
+        return index
+    
+    def toggle_pin(self, message, bubble):
+        """Pin or unpin a message so it always stays in the prompt context"""
+        message["pinned"] = not message.get("pinned")
+        self.journal.append("pin", "", target=message["seq"], pinned=message["pinned"])
+        bubble.config(
+            highlightthickness=2 if message["pinned"] else 0,
+            highlightbackground=CYBERPUNK_COLORS["warning"]
+        )
+    
+    def search_history(self, event=None):
+        """Search all past messages and show the matches"""
+        query = self.search_entry.get().strip()
+        if not query:
+            return "break"
+        
+        started = time.perf_counter()
+        results = self.store.search(query)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.show_search_results(query, results, elapsed_ms)
+        
+        # Keep the global <Return> binding from sending the search text as a message
+        return "break"
+    
+    def show_search_results(self, query, results, elapsed_ms):
+        """Display search results in a Cyberpunk-styled popup"""
+        if self.search_results_window and self.search_results_window.winfo_exists():
+            window = self.search_results_window
+            for child in window.winfo_children():
+                child.destroy()
+        else:
+            window = Toplevel(self.root)
+            window.geometry("700x450")
+            window.configure(bg=CYBERPUNK_COLORS["background"])
+            self.search_results_window = window
+        window.title(f"Search: {query}")
+        
+        summary = Label(
+            window,
+            text=f"{len(results)} MATCHES FOR '{query}' IN {elapsed_ms:.1f} MS",
+            font=("Courier New", 10, "bold"),
+            fg=CYBERPUNK_COLORS["accent"],
+            bg=CYBERPUNK_COLORS["background"]
+        )
+        summary.pack(anchor=W, padx=10, pady=(10, 5))
+        
+        results_text = Text(
+            window,
+            font=("Consolas", 10),
+            fg=CYBERPUNK_COLORS["text"],
+            bg=CYBERPUNK_COLORS["card_bg"],
+            relief="flat",
+            wrap=WORD
+        )
+        results_text.pack(fill=BOTH, expand=True, padx=10, pady=(0, 10))
+        results_text.tag_configure("meta", foreground=CYBERPUNK_COLORS["accent_secondary"])
+        
+        for result in results:
+            when = datetime.datetime.fromtimestamp(result["ts"]).strftime("%Y-%m-%d %H:%M") if result["ts"] else "----"
+            sender = Username if result["role"] == "user" else Assistantname
+            results_text.insert(END, f"{when} {sender}\n", "meta")
+            results_text.insert(END, f"{result['snippet']}\n\n")
+        results_text.config(state="disabled")
     
     def remove_typing_indicator(self):
         """Remove the typing indicator from the chat"""
         if hasattr(self, 'typing_indicator') and self.typing_indicator and self.typing_indicator.winfo_exists():
             self.typing_indicator.destroy()
     
-    def add_message(self, text, sender):
+    def add_message(self, text, sender, message=None):
         """Add a message to the chat display with proper Tkinter anchor values"""
         # Create message frame
         msg_frame = Frame(self.messages_frame, bg=CYBERPUNK_COLORS["card_bg"])
@@ -663,29 +4561,10 @@ You will decide whether a query is a 'general' query, a 'realtime' query, or is
         )
         msg_bubble.pack(side=RIGHT if sender == "user" else LEFT, anchor=align)
         
-        # Format long messages
-        max_width = 80
-        if len(text) > max_width:
-            words = text.split()
-            lines = []
-            current_line = []
-            
-            for word in words:
-                if len(' '.join(current_line + [word])) <= max_width:
-                    current_line.append(word)
-                else:
-                    lines.append(' '.join(current_line))
-                    current_line = [word]
-            
-            if current_line:
-                lines.append(' '.join(current_line))
-            
-            text = '\n'.join(lines)
-        
         # Add message text
         msg_text = Label(
             msg_bubble,
-            text=text,
+            text=self.format_message_text(text),
             font=("Consolas", 11),
             fg=fg_color,
             bg=bg_color,
@@ -695,6 +4574,50 @@ You will decide whether a query is a 'general' query, a 'realtime' query, or is
         )
         msg_text.pack(padx=5, pady=2)
         
+        # Right-click pins the message into the prompt context
+        if message is not None:
+            self.bind_message_pin(msg_bubble, msg_text, message)
+        
+        self.scroll_to_bottom()
+        return msg_bubble, msg_text
+    
+    def format_message_text(self, text):
+        """Wrap long messages at word boundaries"""
+        max_width = 80
+        if len(text) <= max_width:
+            return text
+        
+        words = text.split()
+        lines = []
+        current_line = []
+        
+        for word in words:
+            if len(' '.join(current_line + [word])) <= max_width:
+                current_line.append(word)
+            else:
+                lines.append(' '.join(current_line))
+                current_line = [word]
+        
+        if current_line:
+            lines.append(' '.join(current_line))
+        
+        return '\n'.join(lines)
+    
+    def update_message(self, msg_text, text):
+        """Replace the text of an existing message bubble"""
+        if msg_text.winfo_exists():
+            msg_text.config(text=self.format_message_text(text))
+            self.scroll_to_bottom()
+    
+    def bind_message_pin(self, msg_bubble, msg_text, message):
+        """Let a right-click on the bubble pin or unpin its message"""
+        if message.get("pinned"):
+            msg_bubble.config(highlightthickness=2, highlightbackground=CYBERPUNK_COLORS["warning"])
+        for widget in (msg_bubble, msg_text):
+            widget.bind("<Button-3>", lambda e, m=message, b=msg_bubble: self.toggle_pin(m, b))
+    
+    def scroll_to_bottom(self):
+        """Update the scroll region and keep the newest message in view"""
         # Update scroll region
         self.messages_frame.update_idletasks()
         self.chat_canvas.configure(scrollregion=self.chat_canvas.bbox("all"))
@@ -702,62 +4625,76 @@ You will decide whether a query is a 'general' query, a 'realtime' query, or is
         # Auto-scroll to bottom
         self.chat_canvas.yview_moveto(1.0)
     
-    def speak_response(self, text):
-        """Convert text response to speech"""
-        if self.is_speaking:
-            return
-            
-        self.is_speaking = True
-        self.stop_speaking_flag = False
-        
+    async def speak_response(self, text, priority=SPEECH_PRIORITY_ANSWER):
+        """Convert a complete text response to speech"""
+        speech = self.start_speech(priority)
+        speech.add_text(text)
+        speech.end()
+        await self.play_speech(speech)
+    
+    def start_speech(self, priority=SPEECH_PRIORITY_ANSWER):
+        """Create a speech pipeline that stop_speaking can cancel; runs on the engine"""
+        speech = SpeechPipeline(self.engine.loop, self.tts_cache.synthesize, priority)
+        self.speech_pipelines.add(speech)
+        return speech
+    
+    async def play_speech(self, speech):
+        """Queue a pipeline's utterance on the audio worker and feed it until synthesis is done"""
+        self.audio.speak(speech.utterance)
         try:
-            # Convert text to speech
-            asyncio.run(self.text_to_speech_async(text))
+            await speech.run()
         except Exception as e:
             print(f"Speech error: {e}")
         finally:
-            self.is_speaking = False
+            self.speech_pipelines.discard(speech)
+    
+    def on_playback_state(self, state):
+        """Track playback reported from the audio worker thread"""
+        self.is_speaking = state == "speaking"
+        self.ui.post(self.show_playback_state, state)
     
-    async def text_to_speech_async(self, text):
-        """Async function to handle text-to-speech conversion"""
+    def show_playback_state(self, state):
+        """Show playback in the status bar; runs on the Tk main thread"""
+        if state == "speaking":
+            self.status_label.config(text="STATUS: SPEAKING...", fg=CYBERPUNK_COLORS["accent_secondary"])
+        elif self.is_listening:
+            self.status_label.config(text="STATUS: LISTENING...", fg=CYBERPUNK_COLORS["warning"])
+        elif self.is_voice_mode:
+            self.status_label.config(text="STATUS: READY | MODE: VOICE", fg=CYBERPUNK_COLORS["accent_secondary"])
+        else:
+            self.status_label.config(text="STATUS: READY | MODE: TEXT", fg=CYBERPUNK_COLORS["success"])
+    
+    async def warm_up_speech(self):
+        """Cache common phrases while the assistant is idle so they play without a network round trip"""
         try:
-            # Create the communicate object
-            communicate = edge_tts.Communicate(text, AssistantVoice, pitch='+5Hz', rate='+13%')
-            
-            # Generate speech file
-            await communicate.save("Data/speech.mp3")
-            
-            # Play the audio
-            pygame.mixer.music.load("Data/speech.mp3")
-            pygame.mixer.music.play()
-            
-            # Wait for playback to finish
-            while pygame.mixer.music.get_busy() and not self.stop_speaking_flag:
-                pygame.time.Clock().tick(10)
-                
+            count = await self.tts_cache.warm_up(
+                TTS_WARM_UP_PHRASES,
+                lambda: not self.is_speaking and not self.request_queue.is_busy()
+            )
+            print(f"TTS warm-up synthesized {count} phrases")
         except Exception as e:
-            print(f"TTS error: {e}")
-        finally:
-            try:
-                pygame.mixer.music.stop()
-            except:
-                pass
+            print(f"TTS warm-up error: {e}")
     
     def stop_speaking(self):
-        """Stop the current speech playback"""
-        self.stop_speaking_flag = True
+        """Stop the current speech playback and anything queued to be spoken; safe from any thread"""
+        self.audio.interrupt()
+        self.engine.loop.call_soon_threadsafe(self.cancel_speech)
+    
+    def cancel_speech(self):
+        for speech in list(self.speech_pipelines):
+            speech.cancel()
     
     def load_chat_history(self):
         """Load and display chat history"""
         for message in self.chat_history:
             if message["role"] == "user":
-                self.add_message(message["content"], "user")
+                self.add_message(message["content"], "user", message)
             elif message["role"] == "assistant":
-                self.add_message(message["content"], "assistant")
+                self.add_message(message["content"], "assistant", message)
     
     def check_voice_mode(self):
-        """Periodically check voice mode status"""
-        if self.is_voice_mode and self.is_listening and not self.driver:
+        """Periodically check voice mode status; the recognizer's watchdog restarts a crashed browser"""
+        if self.is_voice_mode and self.is_listening and not self.recognizer.is_alive() and self.recognizer.error:
             self.reset_voice_ui()
             messagebox.showerror("Error", "Speech recognition system disconnected")
         
@@ -765,10 +4702,42 @@ You will decide whether a query is a 'general' query, a 'realtime' query, or is
     
     def cleanup(self):
         """Clean up resources before closing"""
+        # Report per-route latency so routing thresholds can be tuned
+        if hasattr(self, 'router'):
+            for name, stats in self.router.stats().items():
+                print(f"Route {name}: {stats}")
+        if hasattr(self, 'voice_latencies') and self.voice_latencies:
+            print(f"End of speech to request: p50 {percentile(self.voice_latencies, 50):.0f} ms, p95 {percentile(self.voice_latencies, 95):.0f} ms")
+        if hasattr(self, 'intent_classifier'):
+            print(f"Intent classifier: {self.intent_classifier.stats()}")
+            self.intent_classifier.close()
+        if hasattr(self, 'tts_cache'):
+            print(f"TTS cache: {self.tts_cache.stats()}")
+        
         try:
-            if hasattr(self, 'driver') and self.driver:
-                self.driver.quit()
-            pygame.mixer.quit()
+            if hasattr(self, 'engine'):
+                self.engine.stop()
+            if hasattr(self, 'summarizer'):
+                self.summarizer.cancel()
+            if hasattr(self, 'journal'):
+                self.journal.close()
+            if hasattr(self, 'store'):
+                self.store.close()
+            if hasattr(self, 'response_cache'):
+                self.response_cache.close()
+            if hasattr(self, 'reminders'):
+                self.reminders.stop()
+            if hasattr(self, 'knowledge'):
+                self.knowledge.close()
+            if llm:
+                llm.close()
+            if fallback_llm:
+                fallback_llm.close()
+            http_client.close()
+            if hasattr(self, 'recognizer'):
+                self.recognizer.close()
+            if hasattr(self, 'audio'):
+                self.audio.stop()
         except:
             pass
 
@@ -804,6 +4773,7 @@ AssistantVoice=en-US-JennyNeural""")
         root.destroy()
     
     root.protocol("WM_DELETE_WINDOW", on_closing)
+    root.bind("<<AppExit>>", lambda event: on_closing())
     
     # Start the main loop
     root.mainloop()